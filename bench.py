@@ -0,0 +1,215 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+# Keep the source cache, snapshot and scheduler state of the benchmark away from the real ones.
+BENCH_HOME = tempfile.mkdtemp(prefix="geminivpn-bench-")
+os.environ["XDG_CACHE_HOME"] = os.path.join(BENCH_HOME, "cache")
+os.environ["XDG_CONFIG_HOME"] = os.path.join(BENCH_HOME, "config")
+os.environ["LOCALAPPDATA"] = os.environ["XDG_CACHE_HOME"]
+os.environ["APPDATA"] = os.environ["XDG_CONFIG_HOME"]
+
+import core
+
+SIZES = [1000, 10000, 100000, 500000]
+
+# Regression ceilings in microseconds per input line; generous enough for slow CI boxes.
+THRESHOLDS = {
+    "fetch_cold": 10.0,
+    "fetch_304": 5.0,
+    "parse": 10.0,
+    "plan_install": 15.0,
+    "plan_noop": 15.0,
+    "write": 5.0,
+    "snapshot": 20.0,
+    "check_installation": 2.0,
+    "operation_install": 60.0,
+    "operation_noop": 40.0,
+}
+
+# Traced Python heap peak of a full install (and of a re-install over the installed file). Download,
+# decode and write are streamed and the old block is diffed by hash, but the deduplicated entry list
+# and the snapshot index built from it stay in memory, so the peak still grows linearly with the
+# list (about 380 B/line here). Hence an absolute ceiling for lists up to MEMORY_CEILING_LINES, and
+# between the smallest and the largest checked size the peak may grow at most MEMORY_GROWTH times
+# as fast as the line count.
+MEMORY_CEILING_LINES = 100000
+MEMORY_CEILING = 48 * 2**20
+MEMORY_GROWTH = 1.25
+
+def synth_hosts(lines, seed=1):
+    rnd = random.Random(seed)
+    out = ["# synthetic dns.malw.link-style list"]
+    for i in range(lines):
+        r = rnd.random()
+        if r < 0.05:
+            out.append(f"# section {i}")
+        elif r < 0.15:
+            out.append(f"10.{i % 256}.{(i >> 8) % 256}.{i % 200} svc{i}.example{i % 97}.com api.svc{i}.example{i % 97}.com")
+        else:
+            out.append(f"10.{i % 256}.{(i >> 8) % 256}.{i % 200} host{i}.example{i % 97}.com")
+    return "\n".join(out) + "\n"
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def end_headers(self):
+        # SimpleHTTPRequestHandler only does Last-Modified; add a strong ETag so the 304 path is exercised too.
+        path = self.translate_path(self.path)
+        if os.path.isfile(path):
+            st = os.stat(path)
+            self.send_header("ETag", f'"{st.st_mtime_ns:x}-{st.st_size:x}"')
+        super().end_headers()
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isfile(path):
+            st = os.stat(path)
+            if self.headers.get("If-None-Match") == f'"{st.st_mtime_ns:x}-{st.st_size:x}"':
+                self.send_response(304)
+                self.end_headers()
+                return None
+        return super().send_head()
+
+def serve(directory):
+    handler = lambda *a, **k: QuietHandler(*a, directory=directory, **k)
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+class LocalOperation(core.HostsOperation):
+    # Same pipeline as the GUI/CLI, with the elevated copy and DNS flush replaced by a local write.
+    def __init__(self, action, hosts_path=None, sources=None):
+        super().__init__(action, hosts_path, sources, targets=[], backend=core.FakeBackend())
+
+def timed(fn, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        took = time.perf_counter() - started
+        best = took if best is None else min(best, took)
+    return best, result
+
+def bench_size(lines, srv, www, work, repeat):
+    name = f"hosts-{lines}"
+    with open(os.path.join(www, name), "w", encoding="utf-8") as f:
+        f.write(synth_hosts(lines))
+    url = f"http://127.0.0.1:{srv.server_port}/{name}"
+    hosts_path = os.path.join(work, f"hosts-{lines}")
+    with open(hosts_path, "w", encoding="utf-8") as f:
+        f.write(core.DEFAULT_HOSTS)
+    stages = {}
+
+    def fetch_cold():
+        cache = core.SourceCache(tempfile.mkdtemp(dir=work))
+        return cache.fetch(url)
+    stages["fetch_cold"], text = timed(fetch_cold, repeat)
+    warm = core.SourceCache(os.path.join(work, f"cache-{lines}"))
+    warm.fetch(url)
+    stages["fetch_304"], _ = timed(lambda: warm.fetch(url), repeat)
+    stages["parse"], entries = timed(lambda: core.parse_hosts_entries(text), repeat)
+    current = core.read_hosts(hosts_path)
+    stages["plan_install"], plan = timed(lambda: core.plan_hosts(current, entries), repeat)
+    stages["plan_noop"], _ = timed(lambda: core.plan_hosts(plan.text, entries), repeat)
+    out_path = os.path.join(work, f"write-{lines}")
+    stages["write"], _ = timed(lambda: core.atomic_write(out_path, plan.text), repeat)
+    stages["snapshot"], _ = timed(lambda: core.write_snapshot(entries, os.path.join(work, f"snap-{lines}")), repeat)
+    stages["check_installation"], _ = timed(lambda: core.check_installation(out_path), repeat)
+
+    sources = [core.ListSource(name, url, required=True)]
+    def op_install():
+        with open(hosts_path, "w", encoding="utf-8") as f:
+            f.write(core.DEFAULT_HOSTS)
+        return LocalOperation("install", hosts_path, sources).run()
+    stages["operation_install"], _ = timed(op_install, repeat)
+    stages["operation_noop"], noop = timed(lambda: LocalOperation("update", hosts_path, sources).run(), repeat)
+    assert not noop.changed
+
+    # Separate, untimed run: tracemalloc slows allocation-heavy code down several times.
+    with open(hosts_path, "w", encoding="utf-8") as f:
+        f.write(core.DEFAULT_HOSTS)
+    peaks = []
+    for _ in range(2):
+        tracemalloc.start()
+        try:
+            LocalOperation("install", hosts_path, sources).run()
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    peak = max(peaks)
+
+    return {
+        "lines": lines,
+        "entries": len(entries),
+        "bytes": len(text.encode()),
+        "seconds": {k: round(v, 6) for k, v in stages.items()},
+        "us_per_line": {k: round(v / lines * 1e6, 3) for k, v in stages.items()},
+        "peak_bytes": peak,
+        "peak_bytes_install": peaks[0],
+        "peak_bytes_reinstall": peaks[1],
+        "peak_bytes_per_line": round(peak / lines, 1),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GeminiVPN hosts data-path benchmark")
+    parser.add_argument("--sizes", type=lambda v: [int(x) for x in v.split(",")], default=SIZES, help="comma-separated line counts")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, best one is reported")
+    parser.add_argument("--output", help="write the JSON report to this file as well")
+    parser.add_argument("--check", action="store_true", help="exit 1 if any stage exceeds its per-line threshold")
+    args = parser.parse_args(argv)
+
+    www = os.path.join(BENCH_HOME, "www")
+    work = os.path.join(BENCH_HOME, "work")
+    os.makedirs(www)
+    os.makedirs(work)
+    srv = serve(www)
+    try:
+        results = []
+        for lines in args.sizes:
+            res = bench_size(lines, srv, www, work, args.repeat)
+            results.append(res)
+            print(f"{lines:>8} lines  " + "  ".join(f"{k}={v * 1000:.1f}ms" for k, v in res["seconds"].items()) + f"  peak={res['peak_bytes'] / 1e6:.1f}MB", file=sys.stderr)
+    finally:
+        srv.shutdown()
+        shutil.rmtree(BENCH_HOME, ignore_errors=True)
+
+    failures = []
+    for res in results:
+        # Fixed per-call overhead dominates tiny lists, so thresholds only apply from 10k lines up.
+        if res["lines"] < 10000:
+            continue
+        for stage, limit in THRESHOLDS.items():
+            if res["us_per_line"][stage] > limit:
+                failures.append({"lines": res["lines"], "stage": stage, "us_per_line": res["us_per_line"][stage], "limit": limit})
+        if res["lines"] <= MEMORY_CEILING_LINES and res["peak_bytes"] > MEMORY_CEILING:
+            failures.append({"lines": res["lines"], "stage": "peak_memory", "bytes": res["peak_bytes"], "limit": MEMORY_CEILING})
+    checked = sorted((res for res in results if res["lines"] >= 10000), key=lambda res: res["lines"])
+    if len(checked) > 1 and checked[-1]["lines"] > checked[0]["lines"]:
+        small, large = checked[0], checked[-1]
+        growth = (large["peak_bytes"] / small["peak_bytes"]) / (large["lines"] / small["lines"])
+        if growth > MEMORY_GROWTH:
+            failures.append({"lines": [small["lines"], large["lines"]], "stage": "peak_memory_growth", "growth": round(growth, 3), "limit": MEMORY_GROWTH})
+    report = {"python": sys.version.split()[0], "platform": sys.platform, "thresholds": THRESHOLDS,
+              "memory": {"ceiling": MEMORY_CEILING, "ceiling_lines": MEMORY_CEILING_LINES, "growth": MEMORY_GROWTH}, "results": results, "regressions": failures}
+    data = json.dumps(report, indent=2)
+    print(data)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(data)
+    if args.check and failures:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+from core import HOSTS_PATH, PROFILES, HostsOperation, Snapshot, UpdateSchedule, check_installation, load_settings, lookup_domain, run_scheduled_update, save_settings, status_target
+
+def cmd_status(args):
+    settings = load_settings()
+    path, check = status_target(settings)
+    installed = check(path)
+    result = {"installed": installed, "mode": settings["mode"], "hosts_path": HOSTS_PATH, "entries": None, "digest": None}
+    if settings["extra_hosts"]:
+        result["targets"] = [f"{p}: {'installed' if check_installation(p) else 'not installed'}" for p in settings["extra_hosts"]]
+    try:
+        with Snapshot() as snap:
+            result["entries"] = len(snap)
+            result["digest"] = snap.digest.hex()
+    except (OSError, ValueError):
+        pass
+    return result, 0 if installed else 1
+
+def describe_op(op):
+    return {
+        "action": op.action,
+        "ok": True,
+        "changed": op.plan.changed,
+        "added": len(op.plan.added),
+        "removed": len(op.plan.removed),
+        "total": round(op.total, 4),
+        "timings": op.spans(),
+        **({"targets": [{k: v for k, v in r.items() if k != "seconds"} for r in op.results]} if op.results else {}),
+    }
+
+def cmd_apply(args):
+    op = HostsOperation(args.command, targets=args.target)
+    schedule = UpdateSchedule() if args.command != "uninstall" else None
+    try:
+        op.run()
+    except Exception as e:
+        if schedule:
+            schedule.record_failure()
+        return {"action": args.command, "ok": False, "error": str(e)}, 1
+    if schedule:
+        schedule.record_success(op.plan.changed)
+    # The main hosts file went through; a failed extra target still makes the exit code non-zero.
+    return describe_op(op), 1 if any(r["error"] for r in op.results) else 0
+
+def cmd_daemon(args):
+    schedule = UpdateSchedule()
+    if not schedule.enabled:
+        return {"action": "daemon", "ok": False, "error": "auto_update is disabled in settings.json"}, 1
+    while True:
+        if not args.once:
+            # Wake at least hourly so clock jumps and suspend/resume are noticed.
+            time.sleep(min(schedule.seconds_until(), 3600))
+        if schedule.due():
+            started = time.perf_counter()
+            try:
+                op = run_scheduled_update(schedule)
+                result = describe_op(op) if op else {"action": "update", "ok": True, "skipped": "not installed"}
+            except Exception as e:
+                result = {"action": "update", "ok": False, "error": str(e), "failures": schedule.failures}
+            result["next_run"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(schedule.next_run))
+            result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            emit(result, args.json)
+            sys.stdout.flush()
+        if args.once:
+            return {"action": "daemon", "ok": True, "next_run": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(schedule.next_run))}, 0
+
+def cmd_lookup(args):
+    ips = lookup_domain(args.domain)
+    return {"domain": args.domain, "overridden": bool(ips), "ips": ips}, 0 if ips else 1
+
+def cmd_helper(args):
+    import helper
+    if args.helper_cmd == "serve":
+        return {"action": "helper serve", "ok": True, "code": helper.serve_main(args)}, 0
+    if not helper.SUPPORTED:
+        return {"action": f"helper {args.helper_cmd}", "ok": False, "error": "not supported on this platform"}, 1
+    client = helper.HelperClient(args.address)
+    if args.helper_cmd == "start":
+        info = client.ping()
+        if not info:
+            try:
+                targets = args.target if args.target is not None else load_settings()["extra_hosts"]
+                client = helper.start_helper(args.address, hosts_path=args.hosts, targets=targets)
+            except Exception as e:
+                return {"action": "helper start", "ok": False, "error": str(e)}, 1
+            info = client.ping()
+        return {"action": "helper start", "ok": True, "pid": info["pid"], "hosts_path": info["hosts_path"], "targets": info.get("targets", [])}, 0
+    if args.helper_cmd == "stop":
+        try:
+            client.shutdown()
+        except Exception as e:
+            return {"action": "helper stop", "ok": False, "error": str(e)}, 1
+        return {"action": "helper stop", "ok": True}, 0
+    info = client.ping()
+    return {"action": "helper status", "running": bool(info), "pid": info and info["pid"]}, 0 if info else 1
+
+def cmd_profile(args):
+    settings = load_settings()
+    if args.names:
+        unknown = [n for n in args.names if n != "all" and n not in PROFILES]
+        if unknown:
+            return {"action": "profile", "ok": False, "error": f"unknown profile: {', '.join(unknown)}", "available": ["all"] + list(PROFILES)}, 2
+        settings["profiles"] = ["all"] if "all" in args.names else args.names
+        save_settings(settings)
+    # Takes effect on the next install/update.
+    return {"action": "profile", "ok": True, "profiles": settings["profiles"], "available": ["all"] + list(PROFILES)}, 0
+
+def cmd_dns(args):
+    import dnsstub
+    try:
+        dnsstub.serve_main(args.listen, args.upstream)
+    except OSError as e:
+        return {"action": "dns serve", "ok": False, "error": str(e)}, 1
+    return {"action": "dns serve", "ok": True}, 0
+
+def cmd_lan(args):
+    import lanserve
+    try:
+        lanserve.serve_main(args.listen, args.refresh * 60 if args.refresh else None)
+    except OSError as e:
+        return {"action": "lan serve", "ok": False, "error": str(e)}, 1
+    return {"action": "lan serve", "ok": True}, 0
+
+def cmd_delta(args):
+    import delta
+    try:
+        index, changed = delta.publish_main(args.out, args.keep)
+    except Exception as e:
+        return {"action": "delta publish", "ok": False, "error": str(e)}, 1
+    last = index["patches"][-1] if changed and index["patches"] else None
+    return {"action": "delta publish", "ok": True, "changed": changed, "version": index["version"], "entries": index["entries"],
+            "patches": len(index["patches"]), "added": last and last["added"], "removed": last and last["removed"]}, 0
+
+def process_age():
+    # Seconds since this process was created, interpreter start-up and imports included;
+    # None where the platform does not tell.
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+        kernel32 = ctypes.windll.kernel32
+        created, exited, kernel, user, now = (wintypes.FILETIME() for _ in range(5))
+        if not kernel32.GetProcessTimes(kernel32.GetCurrentProcess(), ctypes.byref(created), ctypes.byref(exited),
+                                        ctypes.byref(kernel), ctypes.byref(user)):
+            return None
+        kernel32.GetSystemTimeAsFileTime(ctypes.byref(now))
+        ticks = lambda ft: ft.dwHighDateTime << 32 | ft.dwLowDateTime
+        return (ticks(now) - ticks(created)) / 1e7
+    try:
+        with open("/proc/self/stat", 'r') as f:
+            start_ticks = int(f.read().rpartition(")")[2].split()[19])
+        with open("/proc/uptime", 'r') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 0.0)
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    # SUPPRESS: a subcommand without --json must not reset one given before the subcommand.
+    common.add_argument("--json", action="store_true", default=argparse.SUPPRESS, help="machine-readable output")
+    parser = argparse.ArgumentParser(prog="geminivpn", description="GeminiVPN hosts manager (headless)")
+    parser.add_argument("--json", action="store_true", help="machine-readable output")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", parents=[common]).set_defaults(func=cmd_status)
+    for name in ("install", "update", "uninstall"):
+        apply_p = sub.add_parser(name, parents=[common])
+        apply_p.add_argument("--target", action="append", metavar="PATH",
+                             help="also write this hosts file (repeatable; replaces extra_hosts from settings.json)")
+        apply_p.set_defaults(func=cmd_apply)
+    daemon = sub.add_parser("daemon", parents=[common], help="refresh the lists on the auto-update schedule")
+    daemon.add_argument("--once", action="store_true", help="run the update if it is due, then exit (for cron/timers)")
+    daemon.set_defaults(func=cmd_daemon)
+    helper_p = sub.add_parser("helper", parents=[common], help="persistent privileged helper")
+    helper_p.add_argument("helper_cmd", choices=["start", "stop", "status", "serve"])
+    helper_p.add_argument("--address", help="local socket path / pipe name")
+    helper_p.add_argument("--hosts", default=HOSTS_PATH, help="hosts file the helper manages")
+    helper_p.add_argument("--target", action="append", metavar="PATH",
+                          help="extra hosts file the helper may also write (repeatable; default: extra_hosts from settings.json)")
+    helper_p.add_argument("--key-file", help=argparse.SUPPRESS)
+    helper_p.add_argument("--owner", type=int, help=argparse.SUPPRESS)
+    helper_p.add_argument("--idle-timeout", type=float, default=0, help="exit after this many idle seconds (0 = never)")
+    helper_p.set_defaults(func=cmd_helper)
+    profile = sub.add_parser("profile", parents=[common], help="show or choose the services to write (all, " + ", ".join(PROFILES) + ")")
+    profile.add_argument("names", nargs="*")
+    profile.set_defaults(func=cmd_profile)
+    dns = sub.add_parser("dns", parents=[common], help="local DNS stub that answers from the applied lists (mode \"dns\")")
+    dns.add_argument("dns_cmd", choices=["serve"])
+    dns.add_argument("--listen", help="host:port to listen on (default: dns_listen from settings.json)")
+    dns.add_argument("--upstream", help="host:port to forward other queries to (default: dns_upstream)")
+    dns.set_defaults(func=cmd_dns)
+    lan = sub.add_parser("lan", parents=[common], help="serve the merged lists to other GeminiVPN clients on the LAN")
+    lan.add_argument("lan_cmd", choices=["serve"])
+    lan.add_argument("--listen", help="host:port to listen on (default: lan_listen from settings.json)")
+    lan.add_argument("--refresh", type=float, help="minutes between upstream refreshes (default 60)")
+    lan.set_defaults(func=cmd_lan)
+    delta_p = sub.add_parser("delta", parents=[common], help="publish the merged lists as a baseline plus versioned patches")
+    delta_p.add_argument("delta_cmd", choices=["publish"])
+    delta_p.add_argument("--out", required=True, help="directory to publish into (index.json, latest.snap, *.patch)")
+    delta_p.add_argument("--keep", type=int, default=60, help="patches to keep; older clients fall back to a full download")
+    delta_p.set_defaults(func=cmd_delta)
+    lookup = sub.add_parser("lookup", parents=[common])
+    lookup.add_argument("domain")
+    lookup.set_defaults(func=cmd_lookup)
+    return parser
+
+def emit(result, as_json):
+    if as_json:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+    for key, value in result.items():
+        if key == "timings":
+            for t in value:
+                took = "-" if t['seconds'] is None else f"{t['seconds'] * 1000:.1f} ms"
+                print(f"  {t['step']}: {took}" + (f" ({t['detail']})" if t['detail'] else ""))
+        elif key == "targets" and value and isinstance(value[0], dict):
+            print("targets:")
+            for r in value:
+                print(f"  {r['path']}: " + (r["error"] or (f"+{r['added']} -{r['removed']}" if r["changed"] else "unchanged")))
+        else:
+            print(f"{key}: {', '.join(value) if isinstance(value, list) else value}")
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        result, code = args.func(args)
+    except KeyboardInterrupt:
+        return 130
+    elapsed = process_age()
+    if elapsed is not None:
+        result["elapsed_ms"] = round(elapsed * 1000, 1)
+    emit(result, args.json)
+    return code
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,1683 @@
+import sys
+import os
+import time
+import tempfile
+import subprocess
+import shutil
+import json
+import hashlib
+import mmap
+import struct
+import random
+import queue
+import ipaddress
+import threading
+from array import array
+from itertools import chain, islice
+from operator import itemgetter
+from contextlib import contextmanager
+
+HOSTS_URL = "https://raw.githubusercontent.com/ImMALWARE/dns.malw.link/refs/heads/master/hosts"
+ADD_HOSTS_URL = "https://raw.githubusercontent.com/AvenCores/Goida-AI-Unlocker/refs/heads/main/additional_hosts.py"
+HOSTS_MIRRORS = [HOSTS_URL, "https://cdn.jsdelivr.net/gh/ImMALWARE/dns.malw.link@master/hosts"]
+ADD_HOSTS_MIRRORS = [ADD_HOSTS_URL, "https://cdn.jsdelivr.net/gh/AvenCores/Goida-AI-Unlocker@main/additional_hosts.py"]
+# The first mirror of a source is the publisher itself; a body from it is taken as current up to its
+# CDN cache (raw.githubusercontent.com: max-age=300). The others (jsDelivr branch URLs cache for hours)
+# may lag behind it and are checked against it, see race_mirrors().
+PRIMARY_CACHE_SLACK = 600
+HOSTS_PATH = r"C:\Windows\System32\drivers\etc\hosts" if sys.platform == 'win32' else "/etc/hosts"
+DEFAULT_HOSTS = "127.0.0.1 localhost\n::1 localhost\n"
+MANAGED_BEGIN = "# >>> GeminiVPN managed block (dns.malw.link) >>>"
+MANAGED_END = "# <<< GeminiVPN managed block <<<"
+def get_data_dir():
+    if sys.platform == 'win32':
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        path = os.path.join(base, "GeminiVPN")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        path = os.path.join(base, "geminivpn")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def get_config_dir():
+    if sys.platform == 'win32':
+        base = os.environ.get("APPDATA") or os.path.expanduser("~")
+        path = os.path.join(base, "GeminiVPN")
+    else:
+        base = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+        path = os.path.join(base, "geminivpn")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+DEFAULT_SETTINGS = {
+    "auto_update": True,
+    "update_interval_hours": 6,
+    "update_jitter": 0.1,
+    "retry_base_minutes": 5,
+    "probe_ips": True,
+    "probe_tls": False,
+    "probe_timeout": 1.5,
+    "probe_concurrency": 64,
+    "probe_alternatives": {},
+    "use_helper": False,
+    # "hosts" edits the hosts file; "dns" only compiles the snapshot served by the local DNS stub (dnsstub.py).
+    "mode": "hosts",
+    "dns_listen": "127.0.0.1:53",
+    "dns_upstream": "1.1.1.1:53",
+    # Service profiles to keep from the merged lists (see PROFILES); "all" writes everything.
+    "profiles": ["all"],
+    # URL of a LAN list cache (lanserve.py), tried before upstream; "" fetches upstream directly.
+    "lan_source": "",
+    "lan_listen": "0.0.0.0:8787",
+    # index.json of a published delta chain (delta.py); "" always downloads the full lists.
+    "delta_index": "",
+    # More hosts files that get the same managed block (WSL distros, chroots, container roots).
+    "extra_hosts": [],
+}
+
+# Domain suffixes per service: a profile keeps a name equal to a suffix or ending in "." + suffix.
+PROFILES = {
+    "gemini": [
+        "gemini.google.com", "gemini.google", "bard.google.com", "aistudio.google.com", "makersuite.google.com",
+        "notebooklm.google.com", "notebooklm.google", "labs.google", "ai.google.dev", "deepmind.google",
+        "generativelanguage.googleapis.com", "alkalimakersuite-pa.clients6.google.com",
+        "proactivebackend-pa.googleapis.com", "aisandbox-pa.googleapis.com", "geller-pa.googleapis.com",
+    ],
+    "chatgpt": [
+        "openai.com", "chatgpt.com", "chat.com", "oaistatic.com", "oaiusercontent.com", "sora.com",
+    ],
+    "claude": [
+        "claude.ai", "claude.com", "anthropic.com", "claudeusercontent.com",
+    ],
+}
+
+def load_settings():
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(os.path.join(get_config_dir(), "settings.json"), 'r', encoding='utf-8') as f:
+            stored = json.load(f)
+        if isinstance(stored, dict):
+            settings.update(stored)
+    except (OSError, ValueError):
+        pass
+    return settings
+
+def save_settings(settings):
+    atomic_write(os.path.join(get_config_dir(), "settings.json"), json.dumps(settings, indent=2))
+
+def parse_addr(value, default_port):
+    # "host", "host:port", a bare IPv6 address or "[v6]:port".
+    try:
+        return str(ipaddress.ip_address(value)), default_port
+    except ValueError:
+        pass
+    if value.startswith("["):
+        host, _, rest = value[1:].partition("]")
+        return host, int(rest[1:]) if rest.startswith(":") else default_port
+    host, sep, port = value.rpartition(":")
+    if not sep:
+        return value, default_port
+    return host, int(port)
+
+def check_installation(path=None):
+    # Stops at the first hit: the managed block marker (or a legacy install) mentions dns.malw.link.
+    try:
+        with open(path or HOSTS_PATH, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                if "dns.malw.link" in line:
+                    return True
+    except:
+        pass
+    return False
+
+def status_target(settings=None):
+    # What "connected" means depends on the mode: the managed hosts block, or the snapshot the DNS stub serves.
+    settings = settings or load_settings()
+    if settings["mode"] == "dns":
+        return snapshot_path(), lambda path: snapshot_digest(path) is not None
+    return HOSTS_PATH, check_installation
+
+def hosts_signature(path=None):
+    try:
+        st = os.stat(path or HOSTS_PATH)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def safe_remove(path):
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except:
+        pass
+
+def read_hosts(path=None):
+    try:
+        with open(path or HOSTS_PATH, 'r', encoding='utf-8', errors='ignore') as f:
+            return f.read()
+    except FileNotFoundError:
+        return ""
+
+def iter_hosts_entries(lines, share_ips=True):
+    # Streaming parse: one line at a time, each IP string shared by all of its entries unless the
+    # entries are not kept anyway.
+    ips = {}
+    for line in lines:
+        parts = line.split('#', 1)[0].split()
+        if len(parts) < 2:
+            continue
+        ip = ips.setdefault(parts[0], parts[0]) if share_ips else parts[0]
+        for name in parts[1:]:
+            yield ip, name.lower()
+
+def dedupe_entries(entries):
+    seen = set()
+    for entry in entries:
+        if entry not in seen:
+            seen.add(entry)
+            yield entry
+
+def parse_hosts_entries(text):
+    return list(dedupe_entries(iter_hosts_entries(text.splitlines())))
+
+def filter_entries(entries, profiles):
+    # Lazy, so it can sit between the parser and dedupe. Unknown profile names are ignored;
+    # "all" (or no profile at all) keeps every entry.
+    if not profiles or "all" in profiles:
+        yield from entries
+        return
+    suffixes = {s for p in profiles for s in PROFILES.get(p, ())}
+    for ip, name in entries:
+        labels = name.rstrip(".").split(".")
+        if any(".".join(labels[i:]) in suffixes for i in range(len(labels))):
+            yield ip, name
+
+class TextLines:
+    # Re-iterable lines of text[start:end], sliced off one at a time instead of held in a list.
+    def __init__(self, text, start=0, end=None):
+        self.text = text
+        self.start = start
+        self.end = len(text) if end is None else end
+
+    def __iter__(self):
+        text, pos, end = self.text, self.start, self.end
+        while pos < end:
+            nl = text.find("\n", pos, end)
+            if nl < 0:
+                nl = end
+            yield text[pos:nl].rstrip("\r")
+            pos = nl + 1
+
+def find_line(text, line, start=0):
+    # Offset of the first whole line equal to `line` at or after start, -1 if there is none.
+    while True:
+        i = text.find(line, start)
+        if i < 0:
+            return -1
+        end = i + len(line)
+        if (i == 0 or text[i - 1] == "\n") and (end == len(text) or text[end] in "\r\n"):
+            return i
+        start = i + 1
+
+def split_managed_block(text):
+    # Returns (head, block, tail): head and tail as line lists, the block (usually nearly the whole
+    # file) as TextLines; block is None when nothing is managed yet.
+    b = find_line(text, MANAGED_BEGIN)
+    if b < 0:
+        if "dns.malw.link" in text:
+            # Legacy install: the whole file was overwritten with the upstream list.
+            return DEFAULT_HOSTS.splitlines(), None, []
+        return text.splitlines(), None, []
+    start = text.find("\n", b)
+    start = len(text) if start < 0 else start + 1
+    e = find_line(text, MANAGED_END, start)
+    if e < 0:
+        return text[:b].splitlines(), TextLines(text, start), []
+    tail = text.find("\n", e)
+    return text[:b].splitlines(), TextLines(text, start, e), text[tail + 1:].splitlines() if tail >= 0 else []
+
+def iter_managed_block(entries, per_line=8):
+    # One line per IP with up to per_line names (Windows ignores names past the ninth on a line).
+    # Most IPs carry a single name, which is stored as is rather than in a list of its own.
+    by_ip = {}
+    for ip, name in entries:
+        names = by_ip.setdefault(ip, name)
+        if names is name:
+            continue
+        if isinstance(names, str):
+            by_ip[ip] = [names, name]
+        else:
+            names.append(name)
+    yield MANAGED_BEGIN
+    for ip, names in by_ip.items():
+        if isinstance(names, str):
+            yield ip + " " + names
+            continue
+        for i in range(0, len(names), per_line):
+            yield ip + " " + " ".join(names[i:i + per_line])
+    yield MANAGED_END
+
+def render_managed_block(entries, per_line=8):
+    return list(iter_managed_block(entries, per_line))
+
+def extract_additional_hosts(raw):
+    if 'hosts_add = """' not in raw:
+        return ""
+    return raw.split('hosts_add = """')[1].split('"""')[0].strip()
+
+CHUNK_SIZE = 65536
+
+class FetchCancelled(Exception):
+    pass
+
+class OperationCancelled(Exception):
+    pass
+
+class SourceCache:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_data_dir(), "sources")
+        os.makedirs(self.path, exist_ok=True)
+
+    def _files(self, url):
+        key = hashlib.sha1(url.encode()).hexdigest()[:16]
+        return os.path.join(self.path, f"{key}.json"), os.path.join(self.path, f"{key}.body")
+
+    def _load(self, url):
+        meta_path, body_path = self._files(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            h = hashlib.sha256()
+            with open(body_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    h.update(chunk)
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url or h.hexdigest() != meta.get("sha256"):
+            return None
+        return meta
+
+    def fetch_file(self, url, timeout=15, cancel=None):
+        # The body goes chunk by chunk (gunzipped on the fly) into a temp file next to the cache entry,
+        # so memory stays at one chunk whatever the list size. Returns the cached body path.
+        import zlib
+        import urllib.request
+        import urllib.error
+        meta = self._load(url)
+        meta_path, body_path = self._files(url)
+        headers = {'User-Agent': 'Mozilla/5.0', 'Accept-Encoding': 'gzip'}
+        if meta:
+            if meta.get("etag"):
+                headers['If-None-Match'] = meta["etag"]
+            if meta.get("last_modified"):
+                headers['If-Modified-Since'] = meta["last_modified"]
+        req = urllib.request.Request(url, headers=headers)
+        fd, tmp = tempfile.mkstemp(prefix=".geminivpn-", dir=self.path)
+        try:
+            h = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as f:
+                with urllib.request.urlopen(req, timeout=timeout) as r:
+                    gz = zlib.decompressobj(16 + zlib.MAX_WBITS) if r.headers.get("Content-Encoding") == "gzip" else None
+                    while True:
+                        if cancel is not None and cancel.is_set():
+                            raise FetchCancelled(url)
+                        chunk = r.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        if gz:
+                            chunk = gz.decompress(chunk)
+                        h.update(chunk)
+                        f.write(chunk)
+                    if gz:
+                        chunk = gz.flush()
+                        h.update(chunk)
+                        f.write(chunk)
+                    headers_in = r.headers
+            meta = {
+                "url": url,
+                "etag": headers_in.get("ETag"),
+                "last_modified": headers_in.get("Last-Modified"),
+                "sha256": h.hexdigest(),
+                "fetched": time.time(),
+            }
+            os.replace(tmp, body_path)
+            try:
+                atomic_write(meta_path, json.dumps(meta))
+            except OSError:
+                pass
+            return body_path
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and meta:
+                return body_path
+            raise
+        finally:
+            safe_remove(tmp)
+
+    def body(self, url):
+        return self._files(url)[1]
+
+    def meta(self, url):
+        # Unverified; for a body fetch_file() has just returned. None when there is no entry.
+        try:
+            with open(self._files(url)[0], 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def last_good(self, urls):
+        # Meta of the most recently fetched body that still verifies among `urls` (a source's mirrors), or None.
+        metas = [meta for meta in map(self._load, urls) if meta]
+        return max(metas, key=lambda meta: meta.get("fetched", 0)) if metas else None
+
+    def discard(self, url):
+        for path in self._files(url):
+            safe_remove(path)
+
+    def fetch(self, url, timeout=15, cancel=None):
+        with open(self.fetch_file(url, timeout, cancel), 'r', encoding='utf-8', errors='ignore') as f:
+            return f.read()
+
+class FileLines:
+    # Re-iterable view of a text file, decoded incrementally line by line.
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, 'r', encoding='utf-8', errors='ignore') as f:
+            yield from f
+
+class ListSource:
+    def __init__(self, name, url, required=False, timeout=15, fmt="hosts"):
+        self.name = name
+        self.mirrors = [url] if isinstance(url, str) else list(url)
+        self.url = self.mirrors[0]
+        self.required = required
+        self.timeout = timeout
+        self.fmt = fmt
+
+    def lines(self, path):
+        if self.fmt == "python":
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                return extract_additional_hosts(f.read()).splitlines()
+        return FileLines(path)
+
+    def validate(self, lines):
+        # Cheap sanity check so an error page or captive portal never wins a mirror race.
+        if self.fmt == "python":
+            return any('hosts_add = """' in line for line in lines)
+        for line in islice(lines, 500):
+            parts = line.split('#', 1)[0].split()
+            if len(parts) >= 2 and (parts[0].count('.') == 3 or ':' in parts[0]):
+                return True
+        return False
+
+DEFAULT_SOURCES = [
+    ListSource("dns.malw.link", HOSTS_MIRRORS, required=True),
+    ListSource("additional_hosts", ADD_HOSTS_MIRRORS, fmt="python"),
+]
+
+def load_sources():
+    # Optional override: sources.json in the config dir, a list of {name, url, required, timeout, fmt};
+    # "url" may be a list of mirrors.
+    try:
+        with open(os.path.join(get_config_dir(), "sources.json"), 'r', encoding='utf-8') as f:
+            items = json.load(f)
+        sources = [ListSource(i["name"], i["url"], bool(i.get("required")), float(i.get("timeout", 15)), i.get("fmt", "hosts")) for i in items]
+    except (OSError, ValueError, KeyError, TypeError):
+        return list(DEFAULT_SOURCES)
+    if not any(src.required for src in sources):
+        return list(DEFAULT_SOURCES)
+    return sources
+
+class MirrorStats:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_data_dir(), "mirrors.json")
+        self.lock = threading.Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+
+    def order(self, urls):
+        # Known-good mirrors by smoothed latency, then untried ones in configured order, then failing ones.
+        def key(item):
+            idx, url = item
+            st = self.data.get(url)
+            if not st:
+                return (1, 0, idx)
+            if st.get("failures", 0):
+                return (2, st["failures"], idx)
+            return (0, st.get("ewma", 0), idx)
+        return [url for _, url in sorted(enumerate(urls), key=key)]
+
+    def success(self, url, seconds):
+        with self.lock:
+            st = self.data.setdefault(url, {})
+            st["ewma"] = seconds if "ewma" not in st else 0.7 * st["ewma"] + 0.3 * seconds
+            st["failures"] = 0
+            st["last"] = time.time()
+
+    def failure(self, url):
+        with self.lock:
+            st = self.data.setdefault(url, {})
+            st["failures"] = st.get("failures", 0) + 1
+            st["last"] = time.time()
+
+    def accepted(self, name):
+        with self.lock:
+            return self.data.get("accepted", {}).get(name)
+
+    def accept(self, name, url, meta, primary):
+        # Remembers what the last race for a source returned and how fresh it is known to be.
+        as_of = http_date(meta.get("last_modified"))
+        if as_of is None and primary:
+            as_of = meta.get("fetched", time.time()) - PRIMARY_CACHE_SLACK
+        with self.lock:
+            self.data.setdefault("accepted", {})[name] = {"url": url, "sha256": meta.get("sha256"), "as_of": as_of}
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(self.data)
+        try:
+            atomic_write(self.path, data)
+        except OSError:
+            pass
+
+def http_date(value):
+    from email.utils import parsedate_to_datetime
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def race_mirrors(src, cache, stats, stagger=0.25, abort=None):
+    # Happy-eyeballs style: start the preferred mirror, add the next one every `stagger` seconds
+    # (or at once when one fails), take the first body that validates and cancel the rest.
+    # Setting `abort` stops every attempt of this race within `stagger` seconds.
+    # A secondary mirror whose body differs from the last one returned and is older than it (by
+    # Last-Modified) does not win: without this a lagging CDN rolls the list back and forth.
+    pending = stats.order(src.mirrors)
+    last = stats.accepted(src.name)
+    stale = None
+
+    def fresh(url, meta):
+        if url == src.mirrors[0] or last is None or url == last["url"] or meta.get("sha256") == last["sha256"]:
+            return True
+        modified = http_date(meta.get("last_modified"))
+        return modified is None or last["as_of"] is None or modified >= last["as_of"]
+
+    def fallback(err):
+        # Only stale bodies arrived: keep returning the last accepted one while it is still cached.
+        if stale is None:
+            raise err
+        if cache.last_good([last["url"]]) is not None:
+            return cache.body(last["url"]), last["url"]
+        return stale
+    cancel = threading.Event()
+    results = queue.Queue()
+    deadline = time.monotonic() + src.timeout
+
+    def attempt(url):
+        started = time.perf_counter()
+        try:
+            path = cache.fetch_file(url, src.timeout, cancel)
+            if not src.validate(FileLines(path)):
+                raise ValueError(f"{url}: unexpected content")
+            results.put((url, path, time.perf_counter() - started, None))
+        except Exception as e:
+            results.put((url, None, None, e))
+
+    running = 0
+    launch = True
+    try:
+        while True:
+            if launch and pending:
+                threading.Thread(target=attempt, args=(pending.pop(0),), daemon=True).start()
+                running += 1
+            launch = False
+            if abort is not None and abort.is_set():
+                raise FetchCancelled(src.name)
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return fallback(TimeoutError(f"{src.name}: no mirror answered within {src.timeout:g}s"))
+            try:
+                url, path, took, err = results.get(timeout=min(stagger, left) if pending or abort is not None else left)
+            except queue.Empty:
+                launch = True
+                continue
+            running -= 1
+            if err is None:
+                stats.success(url, took)
+                meta = cache.meta(url) or {}
+                if fresh(url, meta):
+                    stats.accept(src.name, url, meta, url == src.mirrors[0])
+                    return path, url
+                stale = path, url
+                err = ValueError(f"{url}: older than the list already in use")
+            elif not isinstance(err, FetchCancelled):
+                stats.failure(url)
+            if not pending and running == 0:
+                return fallback(err)
+            launch = True
+    finally:
+        cancel.set()
+
+def fetch_sources(sources, cache=None, grace=2.0, timings=None, cancel=None, on_late=None, digests=None):
+    # Returns one iterable of lines per source; hosts-format bodies are read lazily from the cache
+    # file. Every source is fetched at once. Required sources must arrive within their own timeout;
+    # optional ones still in flight after `grace` seconds (or failed) are served from their last
+    # good cached body, so their applied entries are not dropped. A late one is left to finish into
+    # the cache and on_late(name) is called once it has. `digests` gets (name, sha256) of every body used.
+    from concurrent.futures import ThreadPoolExecutor, wait
+    cache = cache or SourceCache()
+    stats = MirrorStats()
+
+    def fetch_one(src):
+        # Timed up to the cached body; the parse is lazy and shows up in the caller's "parse" span.
+        started = time.perf_counter()
+        path, url = race_mirrors(src, cache, stats, abort=cancel)
+        return src.lines(path), time.perf_counter() - started, url
+
+    pool = ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="geminivpn-fetch")
+    futures = [pool.submit(fetch_one, src) for src in sources]
+    try:
+        started = time.monotonic()
+        for src, fut in zip(sources, futures):
+            if src.required:
+                left = src.timeout - (time.monotonic() - started)
+                if fut not in wait([fut], timeout=max(left, 0)).done:
+                    raise TimeoutError(f"{src.name}: timed out after {src.timeout:g}s")
+                fut.result()
+        wait([f for src, f in zip(sources, futures) if not src.required], timeout=grace)
+        parts = []
+        for src, fut in zip(sources, futures):
+            if not fut.done() or fut.exception() is not None:
+                state = "pending" if not fut.done() else "failed"
+                if state == "pending" and on_late is not None:
+                    fut.add_done_callback(lambda f, name=src.name: f.exception() is None and on_late(name))
+                meta = cache.last_good(src.mirrors)
+                if timings is not None:
+                    timings.append((f"fetch:{src.name}", None, state if meta is None else f"{state}, cached"))
+                if meta is not None:
+                    # Read now: the late download may replace this file while the merge still runs.
+                    parts.append(list(src.lines(cache.body(meta["url"]))))
+                    if digests is not None:
+                        digests.append((src.name, meta["sha256"]))
+                continue
+            lines, fetch_s, url = fut.result()
+            if timings is not None:
+                timings.append((f"fetch:{src.name}", fetch_s, url.split('/')[2]))
+            if digests is not None:
+                digests.append((src.name, (cache.meta(url) or {}).get("sha256")))
+            parts.append(lines)
+        return parts
+    finally:
+        pool.shutdown(wait=False)
+        stats.save()
+
+class HostsPlan:
+    def __init__(self, text, added, removed, changed, parts=None):
+        # A plan that writes a managed block keeps (head, entries, tail) instead of the final text;
+        # the block is rendered while it is written, and text is only joined when asked for.
+        self._text = text
+        self.parts = parts
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    def lines(self):
+        if self.parts is None:
+            return iter(self._text.splitlines())
+        head, entries, tail = self.parts
+        return chain(head, iter_managed_block(entries), tail)
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = "".join(self.chunks())
+        return self._text
+
+    def chunks(self, batch=4096):
+        if self._text is not None:
+            yield self._text
+            return
+        lines = self.lines()
+        while True:
+            block = list(islice(lines, batch))
+            if not block:
+                return
+            yield "\n".join(block) + "\n"
+
+def plan_hosts(current, entries):
+    # entries=None means "remove the managed block"; otherwise entries are deduplicated (dedupe_entries).
+    head, block, tail = split_managed_block(current)
+    new = entries or []
+    # The old block is held as entry hashes only, and parsed a second time just when something was
+    # removed from it. A hash collision could only hide a change, at odds of about n^2 / 2^64.
+    old = {hash(e) for e in iter_hosts_entries(block, share_ips=False)} if block is not None else set()
+    added = [e for e in new if hash(e) not in old]
+    removed = []
+    if len(old) != len(new) - len(added):
+        new_set = set(new)
+        removed = list(dedupe_entries(e for e in iter_hosts_entries(block) if e not in new_set))
+    legacy = block is None and "dns.malw.link" in current
+    if entries is None:
+        changed = block is not None or legacy
+    else:
+        changed = block is None or bool(added or removed)
+    if not changed:
+        return HostsPlan(current, added, removed, False)
+    while head and not head[-1].strip():
+        head.pop()
+    while head and not head[0]:
+        head.pop(0)
+    head += [""] if head else []
+    if entries is not None:
+        while tail and not tail[-1]:
+            tail.pop()
+        return HostsPlan(None, added, removed, True, (head, new, tail))
+    out = head + tail
+    while out and not out[-1]:
+        out.pop()
+    while out and not out[0]:
+        out.pop(0)
+    return HostsPlan("\n".join(out) + "\n", added, removed, True)
+
+def plan_snapshot(entries):
+    # Same shape as plan_hosts, but against the applied snapshot; used by the DNS stub mode.
+    old = snapshot_entries()
+    old_set, new_set = set(old), set(entries)
+    added = [e for e in entries if e not in old_set]
+    removed = [e for e in old if e not in new_set]
+    return HostsPlan(None, added, removed, snapshot_digest() != entries_digest(entries))
+
+def atomic_write(path, data):
+    # data: str, bytes, or an iterable of str/bytes chunks that is written as it is produced.
+    if isinstance(data, (str, bytes)):
+        data = (data,)
+    fd, tmp = tempfile.mkstemp(prefix=".geminivpn-", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in data:
+                f.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # /etc/hosts bind-mounted into containers cannot be renamed over.
+            shutil.copyfile(tmp, path)
+    finally:
+        safe_remove(tmp)
+
+SNAP_MAGIC = b"GVPNSNAP"
+SNAP_HEADER = struct.Struct("<8sIII32sIIII")
+SNAP_RECORD = struct.Struct("<IHIH")
+SNAP_IP = struct.Struct("<48s")
+SNAP_REF = struct.Struct("<I")
+
+def snapshot_path():
+    return os.path.join(get_data_dir(), "applied.snap")
+
+def applied_state_path():
+    return os.path.join(get_data_dir(), "applied.json")
+
+def entries_digest(entries, batch=4096):
+    h = hashlib.sha256()
+    ordered = sorted(entries)
+    for i in range(0, len(ordered), batch):
+        h.update("".join(f"{ip} {name}\n" for ip, name in ordered[i:i + batch]).encode())
+    return h.digest()
+
+def iter_snapshot(entries):
+    # Yields the snapshot file in sections. Working memory is a sorted list of references plus
+    # the packed sections themselves, no per-name Python objects. Sorting str names gives the
+    # same order as sorting their UTF-8 bytes, which lookup() relies on.
+    ips = sorted({ip for ip, _ in entries})
+    ip_idx = {ip: i for i, ip in enumerate(ips)}
+    records, refs, blob = bytearray(), array('I'), bytearray()
+    count = 0
+    prev = None
+    ref_start = 0
+    for ip, name in sorted(entries, key=itemgetter(1)):
+        if name != prev:
+            if prev is not None:
+                records += SNAP_RECORD.pack(len(blob) - len(raw), len(raw), ref_start, len(refs) - ref_start)
+            raw = name.encode()
+            blob += raw
+            ref_start = len(refs)
+            prev = name
+            count += 1
+        refs.append(ip_idx[ip])
+    if prev is not None:
+        records += SNAP_RECORD.pack(len(blob) - len(raw), len(raw), ref_start, len(refs) - ref_start)
+    if sys.byteorder != "little":
+        refs.byteswap()
+    off_records = SNAP_HEADER.size
+    off_refs = off_records + len(records)
+    off_ips = off_refs + len(refs) * SNAP_REF.size
+    off_names = off_ips + len(ips) * SNAP_IP.size
+    yield SNAP_HEADER.pack(SNAP_MAGIC, 1, count, len(ips), entries_digest(entries), off_records, off_refs, off_ips, off_names)
+    yield records
+    yield refs.tobytes()
+    for i in range(0, len(ips), 4096):
+        yield b"".join(SNAP_IP.pack(ip.encode()) for ip in ips[i:i + 4096])
+    yield blob
+
+def compile_snapshot(entries):
+    return b"".join(iter_snapshot(entries))
+
+def write_snapshot(entries, path=None):
+    atomic_write(path or snapshot_path(), iter_snapshot(entries))
+
+class Snapshot:
+    def __init__(self, path=None):
+        with open(path or snapshot_path(), 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.ip_count, self.digest, self.off_records, self.off_refs, self.off_ips, self.off_names = SNAP_HEADER.unpack_from(self.mm, 0)
+        if magic != SNAP_MAGIC or version != 1:
+            self.mm.close()
+            raise ValueError("not a GeminiVPN snapshot")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.mm.close()
+
+    def _record(self, i):
+        off, ln, ref_start, ref_count = SNAP_RECORD.unpack_from(self.mm, self.off_records + i * SNAP_RECORD.size)
+        return self.mm[self.off_names + off:self.off_names + off + ln], ref_start, ref_count
+
+    def _ip(self, i):
+        return SNAP_IP.unpack_from(self.mm, self.off_ips + i * SNAP_IP.size)[0].rstrip(b"\0").decode()
+
+    def lookup(self, domain):
+        key = domain.strip().rstrip('.').lower().encode()
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            name, ref_start, ref_count = self._record(mid)
+            if name < key:
+                lo = mid + 1
+            elif name > key:
+                hi = mid
+            else:
+                return [self._ip(SNAP_REF.unpack_from(self.mm, self.off_refs + (ref_start + k) * SNAP_REF.size)[0]) for k in range(ref_count)]
+        return []
+
+    def entries(self):
+        for i in range(self.count):
+            name, ref_start, ref_count = self._record(i)
+            for k in range(ref_count):
+                yield self._ip(SNAP_REF.unpack_from(self.mm, self.off_refs + (ref_start + k) * SNAP_REF.size)[0]), name.decode()
+
+def snapshot_digest(path=None):
+    try:
+        with open(path or snapshot_path(), 'rb') as f:
+            head = f.read(SNAP_HEADER.size)
+        magic, version, _, _, digest, *_ = SNAP_HEADER.unpack(head)
+    except (OSError, struct.error):
+        return None
+    return digest if magic == SNAP_MAGIC and version == 1 else None
+
+def snapshot_entries(path=None):
+    try:
+        with Snapshot(path) as snap:
+            return list(snap.entries())
+    except (OSError, ValueError):
+        return []
+
+def known_entries(entries, paths):
+    # Keeps the entries whose name one of the snapshots at `paths` already has: an unauthenticated
+    # source (the LAN cache) may re-point names that came from upstream, never add new ones.
+    snaps = []
+    for path in paths:
+        try:
+            snaps.append(Snapshot(path))
+        except (OSError, ValueError):
+            pass
+    try:
+        for ip, name in entries:
+            if any(snap.lookup(name) for snap in snaps):
+                yield ip, name
+    finally:
+        for snap in snaps:
+            snap.close()
+
+def lookup_domain(domain, path=None):
+    try:
+        with Snapshot(path) as snap:
+            return snap.lookup(domain)
+    except (OSError, ValueError):
+        return []
+
+class FlushStrategy:
+    name = "none"
+    command = None
+    argv = None
+
+    def available(self):
+        return False
+
+    def run(self):
+        subprocess.run(self.argv or self.command.split(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+class WindowsDnsFlush(FlushStrategy):
+    name = "dnscache"
+    command = "Clear-DnsClientCache"
+    argv = ["ipconfig", "/flushdns"]
+
+    def available(self):
+        return sys.platform == 'win32'
+
+class ResolvedFlush(FlushStrategy):
+    name = "systemd-resolved"
+    command = "resolvectl flush-caches"
+
+    def available(self):
+        return sys.platform.startswith('linux') and os.path.exists("/run/systemd/resolve/io.systemd.Resolve") and shutil.which("resolvectl") is not None
+
+class NscdFlush(FlushStrategy):
+    name = "nscd"
+    command = "nscd -i hosts"
+
+    def available(self):
+        return any(os.path.exists(p) for p in ("/run/nscd/socket", "/var/run/nscd/socket")) and shutil.which("nscd") is not None
+
+class DnsmasqFlush(FlushStrategy):
+    name = "dnsmasq"
+    command = "killall -HUP dnsmasq"
+
+    def available(self):
+        if not shutil.which("dnsmasq") or not os.path.isdir("/proc"):
+            return False
+        for pid in os.listdir("/proc"):
+            try:
+                with open(f"/proc/{pid}/comm", 'r') as f:
+                    if f.read().strip() == "dnsmasq":
+                        return True
+            except OSError:
+                continue
+        return False
+
+FLUSH_STRATEGIES = [WindowsDnsFlush(), ResolvedFlush(), NscdFlush(), DnsmasqFlush()]
+
+def pick_flush_strategies():
+    # Plain glibc reads the hosts file on every lookup, so with no caching daemon running nothing is flushed.
+    return [fs for fs in FLUSH_STRATEGIES if fs.available()]
+
+class PrivilegeBackend:
+    # Gets the planned hosts file in place with whatever rights that takes, then runs the resolver flushes.
+    name = "none"
+    # Seconds to wait after the swap so the resolver has the new file before the status check.
+    settle = 1.0
+
+    def available(self):
+        return False
+
+    def flushes(self):
+        return pick_flush_strategies()
+
+    def apply(self, op, plan, flushes, targets=()):
+        # plan is None when only `targets` (result dicts with "path" and "plan") change. A failure on the
+        # main file raises before any target is written; a failing target only sets its own "error".
+        raise NotImplementedError
+
+def write_targets(targets):
+    for r in targets:
+        started = time.perf_counter()
+        try:
+            atomic_write(r["path"], r["plan"].chunks())
+        except Exception as e:
+            r.update(changed=False, error=str(e))
+        r["seconds"] += time.perf_counter() - started
+
+class DirectBackend(PrivilegeBackend):
+    name = "direct"
+
+    def available(self):
+        return sys.platform != 'win32' and os.geteuid() == 0
+
+    def apply(self, op, plan, flushes, targets=()):
+        if plan is not None:
+            with op.span("swap"):
+                atomic_write(op.hosts_path, plan.chunks())
+            for fs in flushes:
+                with op.span("flush", fs.name):
+                    fs.run()
+        write_targets(targets)
+
+class ElevatedBackend(PrivilegeBackend):
+    # The new files go to temp copies; one elevated script swaps them in (main file first, stopping
+    # if that fails), flushes and reports its own swap/flush durations through a log file and the
+    # indexes of the extra files it wrote through a second one.
+    def apply(self, op, plan, flushes, targets=()):
+        temps = []
+        try:
+            with op.span("write_temp"):
+                for chunks in ([plan.chunks()] if plan is not None else []) + [r["plan"].chunks() for r in targets]:
+                    with tempfile.NamedTemporaryFile('w', delete=False, suffix='.txt', encoding='utf-8') as tf:
+                        temps.append(tf.name)
+                        tf.writelines(chunks)
+            for _ in range(2):
+                fd, path = tempfile.mkstemp(suffix='.log')
+                os.close(fd)
+                temps.append(path)
+            l_path, r_path = temps[-2:]
+            t_path = temps[0] if plan is not None else None
+            moves = list(zip(temps[int(plan is not None):-2], (r["path"] for r in targets)))
+            started = time.perf_counter()
+            self.run(op.hosts_path, t_path, l_path, flushes, moves, r_path)
+            op._elevated_spans(time.perf_counter() - started, l_path)
+            with open(r_path, 'r', encoding='utf-8-sig') as f:
+                written = set(f.read().split())
+            for i, r in enumerate(targets):
+                if str(i) not in written:
+                    r.update(changed=False, error="elevated write failed")
+        finally:
+            for path in temps:
+                safe_remove(path)
+
+    def run(self, hosts_path, t_path, l_path, flushes, moves, r_path):
+        # t_path is None when the main file stays as it is; moves: (temp, path) per extra file,
+        # whose index goes to r_path once it is in place.
+        raise NotImplementedError
+
+class RunAsBackend(ElevatedBackend):
+    name = "runas"
+
+    def available(self):
+        return sys.platform == 'win32'
+
+    def run(self, hosts_path, t_path, l_path, flushes, moves, r_path):
+        fc = "".join(f";{fs.command}" for fs in flushes)
+        swap = lambda s, d: f'Copy-Item -Path "{s}" -Destination "{d}.geminivpn" -Force;[IO.File]::Replace("{d}.geminivpn","{d}",$null)'
+        main = f"{swap(t_path, hosts_path)};" if t_path else ""
+        extra = "".join(f';try{{{swap(s, d)};"{i}" | Add-Content -Path "{r_path}"}}catch{{}}' for i, (s, d) in enumerate(moves))
+        ps_c = f'$ErrorActionPreference="Stop";$w=[Diagnostics.Stopwatch]::StartNew();{main}$a=$w.Elapsed.TotalSeconds{fc};$b=$w.Elapsed.TotalSeconds-$a;"$a $b" | Set-Content -Path "{l_path}"{extra}'
+        s_path = None
+        try:
+            with tempfile.NamedTemporaryFile('w', delete=False, suffix='.ps1', encoding='utf-8') as pf:
+                pf.write(ps_c)
+                s_path = pf.name
+            cmd = ["powershell", "-WindowStyle", "Hidden", "-Command", f'Start-Process powershell -Verb runAs -WindowStyle Hidden -ArgumentList \'-NoProfile -ExecutionPolicy Bypass -File "{s_path}"\' -Wait']
+            subprocess.run(cmd, check=True, creationflags=subprocess.CREATE_NO_WINDOW)
+        finally:
+            if s_path: safe_remove(s_path)
+
+class PkexecBackend(ElevatedBackend):
+    name = "pkexec"
+
+    def available(self):
+        return sys.platform != 'win32'
+
+    def run(self, hosts_path, t_path, l_path, flushes, moves, r_path):
+        fc = f" && {{ {' '.join(f'{fs.command} || true;' for fs in flushes)} }}" if flushes else ""
+        swap = lambda s, d: f"cp '{s}' '{d}.geminivpn' && chmod 644 '{d}.geminivpn' && (mv -f '{d}.geminivpn' '{d}' || (cp '{d}.geminivpn' '{d}' && rm -f '{d}.geminivpn'))"
+        main = f" && {swap(t_path, hosts_path)}" if t_path else ""
+        extra = "".join(f" && {{ {{ {swap(s, d)}; }} && echo {i} >> '{r_path}' || true; }}" for i, (s, d) in enumerate(moves))
+        bc = (f"t0=$(date +%s%N){main}"
+              f" && t1=$(date +%s%N){fc} && t2=$(date +%s%N) && echo \"$(((t1-t0)/1000))e-6 $(((t2-t1)/1000))e-6\" > '{l_path}'{extra}")
+        subprocess.run(["pkexec", "bash", "-c", bc], check=True)
+
+class FakeBackend(PrivilegeBackend):
+    # For benchmarks and the latency harness: a plain local write with the prompt and the flush replaced
+    # by configurable delays (base seconds, +/- jitter as a fraction) and an injected failure rate.
+    name = "fake"
+
+    def __init__(self, elevate=0.0, flush=0.0, jitter=0.0, failure_rate=0.0, settle=0.0, seed=None):
+        self.elevate = elevate
+        self.flush = flush
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.settle = settle
+        self.rnd = random.Random(seed)
+
+    def available(self):
+        return True
+
+    def flushes(self):
+        return []
+
+    def _wait(self, seconds):
+        if seconds:
+            time.sleep(seconds * (1 + self.rnd.uniform(-self.jitter, self.jitter)))
+
+    def apply(self, op, plan, flushes, targets=()):
+        with op.span("elevate", self.name):
+            self._wait(self.elevate)
+            if self.rnd.random() < self.failure_rate:
+                # What a declined prompt looks like to the caller.
+                raise subprocess.CalledProcessError(1, "fake-elevate")
+        if plan is not None:
+            with op.span("swap"):
+                atomic_write(op.hosts_path, plan.chunks())
+            with op.span("flush", self.name):
+                self._wait(self.flush)
+        write_targets(targets)
+
+PRIVILEGE_BACKENDS = [RunAsBackend(), DirectBackend(), PkexecBackend()]
+
+def pick_privilege_backend():
+    return next(b for b in PRIVILEGE_BACKENDS if b.available())
+
+METRICS_MAX_BYTES = 512 * 1024
+
+def metrics_path():
+    return os.path.join(get_data_dir(), "metrics.jsonl")
+
+def record_metrics(record, path=None):
+    path = path or metrics_path()
+    line = json.dumps(record, ensure_ascii=False)
+    if os.environ.get("GEMINIVPN_TRACE"):
+        print(line, file=sys.stderr)
+    try:
+        if os.path.exists(path) and os.path.getsize(path) > METRICS_MAX_BYTES:
+            os.replace(path, path + ".1")
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+    except OSError:
+        pass
+
+def load_metrics(limit=200, path=None):
+    path = path or metrics_path()
+    lines = []
+    for p in (path + ".1", path):
+        try:
+            with open(p, 'r', encoding='utf-8') as f:
+                lines.extend(f.readlines())
+        except OSError:
+            pass
+    records = []
+    for line in lines[-limit:]:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            pass
+    return records
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def summarize_metrics(records=None):
+    records = load_metrics() if records is None else records
+    totals = [r["total"] for r in records if r.get("ok") and r.get("total") is not None]
+    return {
+        "count": len(totals),
+        "last": totals[-1] if totals else None,
+        "p50": percentile(totals, 0.5),
+        "p95": percentile(totals, 0.95),
+    }
+
+class HostsOperation:
+    def __init__(self, action, hosts_path=None, sources=None, targets=None, backend=None):
+        self.action = action
+        self.hosts_path = hosts_path or HOSTS_PATH
+        self.sources = sources
+        # Extra hosts files; None takes "extra_hosts" from the settings. One result dict per target.
+        self.targets = targets
+        self.results = []
+        # None picks the platform's elevation (see PRIVILEGE_BACKENDS); FakeBackend for benchmarks.
+        self.backend = backend
+        self.timings = []
+        self.plan = None
+        self.total = None
+        # (name, sha256) per source body this run merged; None when the list came another way (LAN, delta, baseline).
+        self.digests = None
+        # Called with a source name when an optional source that missed the grace period has landed.
+        self.on_late = None
+        # Honoured up to the moment the hosts file (or snapshot) is about to be written.
+        self.cancel = threading.Event()
+
+    @contextmanager
+    def span(self, name, detail=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((name, time.perf_counter() - started, detail))
+
+    def checkpoint(self):
+        if self.cancel.is_set():
+            raise OperationCancelled(self.action)
+
+    def spans(self):
+        return [{"step": name, "seconds": None if sec is None else round(sec, 4), "detail": detail} for name, sec, detail in self.timings]
+
+    def run(self):
+        started = time.perf_counter()
+        error = None
+        try:
+            if self.action in ("install", "update"):
+                self.install()
+            else:
+                self.uninstall()
+            return self.plan
+        except FetchCancelled:
+            error = "cancelled"
+            raise OperationCancelled(self.action)
+        except OperationCancelled:
+            error = "cancelled"
+            raise
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self.total = time.perf_counter() - started
+            record_metrics({
+                "ts": round(time.time(), 3),
+                "action": self.action,
+                "ok": error is None,
+                "error": error,
+                "changed": self.plan.changed if self.plan else None,
+                "total": round(self.total, 4),
+                "spans": self.spans(),
+            })
+
+    def install(self):
+        settings = load_settings()
+        with self.span("fetch"):
+            lines = self._fetch(settings)
+        self.checkpoint()
+        state = self._applied_state(settings)
+        if self.action == "update" and state is not None and self._last_applied() == state:
+            # Same source bodies and settings as the last applied run, and nothing has touched the written
+            # files since: the merge would only reproduce what is there. Connect always does the full run.
+            self.plan = HostsPlan("", [], [], False)
+            self.timings.append(("merge", None, "inputs unchanged"))
+            return
+        safe_remove(applied_state_path())
+        dns_mode = settings["mode"] == "dns"
+        current = None if dns_mode else read_hosts(self.hosts_path)
+        profiles = settings["profiles"]
+        filtered = bool(profiles) and "all" not in profiles
+        with self.span("parse"):
+            # Streaming: cache file -> decoded lines -> entries -> dedupe; the lazy fetch is paid here.
+            entries = list(dedupe_entries(iter_hosts_entries(lines)))
+            if filtered:
+                total = len(entries)
+                entries = list(filter_entries(entries, profiles))
+        if filtered:
+            self.timings[-1] = self.timings[-1][:2] + (f"{','.join(profiles)}: {len(entries)} of {total}",)
+        if filtered and not entries:
+            raise ValueError(f"profiles {', '.join(profiles)} matched no entries in the lists")
+        self.checkpoint()
+        if settings["probe_ips"]:
+            from probe import pick_fastest
+            if dns_mode:
+                applied = snapshot_entries()
+            else:
+                _, block, _ = split_managed_block(current)
+                applied = iter_hosts_entries(block) if block is not None else ()
+            with self.span("probe"):
+                entries, stats = pick_fastest(entries, applied, settings["probe_alternatives"], timeout=float(settings["probe_timeout"]),
+                                              concurrency=int(settings["probe_concurrency"]), tls=bool(settings["probe_tls"]))
+            self.timings[-1] = self.timings[-1][:2] + (f"{stats['contested']} contested, {stats['probed']} probed, {stats['switched']} switched",)
+            self.checkpoint()
+        if dns_mode:
+            # The stub reloads the snapshot on its own; no hosts write, no resolver flush. Elevation
+            # only if extra hosts files need it.
+            targets = self._extra_targets(settings, entries)
+            with self.span("merge"):
+                self.plan = plan_snapshot(entries)
+            self.checkpoint()
+            if self.plan.changed:
+                with self.span("snapshot"):
+                    write_snapshot(entries)
+            self._commit(entries, targets(), main=False)
+        else:
+            targets = self._extra_targets(settings, entries)
+            with self.span("merge"):
+                self.plan = plan_hosts(current, entries)
+            self.checkpoint()
+            self._commit(entries, targets())
+            if self.plan.changed or snapshot_digest() != entries_digest(entries):
+                with self.span("snapshot"):
+                    write_snapshot(entries)
+        if state is not None and not any(r["error"] for r in self.results):
+            # Taken after the writes, so the next update can tell whether anything else changed them.
+            state["files"] = self._applied_state(settings)["files"]
+            try:
+                atomic_write(applied_state_path(), json.dumps(state))
+            except OSError:
+                pass
+
+    def _applied_state(self, settings):
+        # What the merged result depends on (source bodies and the settings that shape them) plus
+        # the signature of every file it ends up in. None when the bodies are not known.
+        if self.digests is None:
+            return None
+        inputs = {"sources": sorted(self.digests, key=lambda d: d[0]), "profiles": settings["profiles"], "mode": settings["mode"],
+                  "probe": [settings["probe_ips"], settings["probe_alternatives"], settings["probe_tls"]]}
+        paths = [snapshot_path()] + ([] if settings["mode"] == "dns" else [self.hosts_path]) + self._target_paths(settings)
+        sigs = {p: hosts_signature(p) for p in paths}
+        return {"inputs": hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest(),
+                "files": {p: sig and list(sig) for p, sig in sigs.items()}}
+
+    def _last_applied(self):
+        try:
+            with open(applied_state_path(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _fetch(self, settings):
+        lan_source = settings["lan_source"]
+        self.digests = None
+        if lan_source and not self.sources:
+            # The LAN cache serves the merged list already; upstream is only the fallback. Plain HTTP
+            # from any host on the LAN, so it only gets to set names an upstream list already has
+            # (the full synced base, the bundled baseline or the applied list).
+            import delta
+            known = [p for p in (delta.base_path(), delta.bundled_baseline(), snapshot_path()) if snapshot_digest(p) is not None]
+            started = time.perf_counter()
+            try:
+                if not known:
+                    raise ValueError("no upstream list to check the LAN list against")
+                lines = FileLines(SourceCache().fetch_file(lan_source, 3, self.cancel))
+                if ListSource("lan", lan_source).validate(lines):
+                    self.timings.append(("fetch:lan", time.perf_counter() - started, f"{lan_source.split('/')[2]}, known names only"))
+                    return (f"{ip} {name}" for ip, name in known_entries(iter_hosts_entries(lines), known))
+            except Exception:
+                self.checkpoint()
+            self.timings.append(("fetch:lan", None, "failed" if known else "no local list yet"))
+        if self.sources:
+            self.digests = []
+            return chain.from_iterable(fetch_sources(self.sources, timings=self.timings, cancel=self.cancel, on_late=self.on_late, digests=self.digests))
+        import delta
+        if settings["delta_index"]:
+            started = time.perf_counter()
+            try:
+                entries, detail = delta.sync_lists(settings["delta_index"], cancel=self.cancel)
+                self.timings.append(("fetch:delta", time.perf_counter() - started, detail))
+                return (f"{ip} {name}" for ip, name in entries)
+            except FetchCancelled:
+                raise
+            except Exception as e:
+                self.timings.append(("fetch:delta", None, "chain broken" if isinstance(e, delta.DeltaUnavailable) else "failed"))
+        digests = []
+        try:
+            parts = fetch_sources(load_sources(), timings=self.timings, cancel=self.cancel, on_late=self.on_late, digests=digests)
+        except FetchCancelled:
+            raise
+        except Exception:
+            # Offline first connect: the last synced list (or the one shipped with the app) beats failing.
+            # Never for updates, which would roll an applied list back.
+            base = next((p for p in (delta.base_path(), delta.bundled_baseline()) if snapshot_digest(p) is not None), None)
+            if self.action != "install" or base is None:
+                raise
+            self.timings.append(("fetch:baseline", None, "offline"))
+            return (f"{ip} {name}" for ip, name in snapshot_entries(base))
+        if not settings["delta_index"]:
+            self.digests = digests
+            return chain.from_iterable(parts)
+        # Re-seed the delta base from the full lists, so the next update can patch again.
+        # Sorted like sync_lists() returns them, so switching between the two never reorders the block.
+        entries = sorted(dedupe_entries(iter_hosts_entries(chain.from_iterable(parts))))
+        write_snapshot(entries, delta.base_path())
+        return (f"{ip} {name}" for ip, name in entries)
+
+    def uninstall(self):
+        settings = load_settings()
+        with self.span("merge"):
+            self.plan = plan_hosts(read_hosts(self.hosts_path), None)
+        self.checkpoint()
+        self._commit(None, self._extra_targets(settings, None)())
+        if settings["mode"] == "dns" and snapshot_digest() is not None:
+            # In DNS stub mode dropping the snapshot is what actually disconnects.
+            self.plan.changed = True
+        safe_remove(snapshot_path())
+        safe_remove(applied_state_path())
+
+    def _target_paths(self, settings):
+        return [p for p in (self.targets if self.targets is not None else settings["extra_hosts"]) if p != self.hosts_path]
+
+    def _extra_targets(self, settings, entries):
+        # The extra files are diffed on their own threads while the main one is; call the result to
+        # collect the plans. Entries are shared; a failing target only fails its own result.
+        targets = self._target_paths(settings)
+        if not targets:
+            return lambda: []
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(max_workers=min(len(targets), 8), thread_name_prefix="geminivpn-target")
+        futures = [pool.submit(self._plan_target, path, entries) for path in targets]
+        pool.shutdown(wait=False)
+        return lambda: [f.result() for f in futures]
+
+    def _plan_target(self, path, entries):
+        started = time.perf_counter()
+        result = {"path": path, "changed": False, "added": 0, "removed": 0, "error": None, "plan": None}
+        try:
+            # A missing file is a stopped distro or a typo, never something to create.
+            if not os.path.isfile(path):
+                raise FileNotFoundError("no such hosts file")
+            plan = plan_hosts(read_hosts(path), entries)
+            result.update(changed=plan.changed, added=len(plan.added), removed=len(plan.removed), plan=plan if plan.changed else None)
+        except Exception as e:
+            result["error"] = str(e)
+        result["seconds"] = time.perf_counter() - started
+        return result
+
+    def _commit(self, entries, targets, main=True):
+        # The main hosts file and the changed extra files are written together, with one elevation
+        # (or one helper request): extra files are root-owned as often as the main one. The main
+        # file goes first; when it is not written (declined prompt, failure) no extra file is touched.
+        plan = self.plan if main and self.plan.changed else None
+        writes = [r for r in targets if r["plan"] is not None]
+        try:
+            if plan is not None or writes:
+                self._write(plan, entries, writes)
+        except Exception:
+            for r in writes:
+                r.update(changed=False, error="skipped: the main hosts file was not written")
+            raise
+        finally:
+            self.results = [{k: v for k, v in r.items() if k != "plan"} for r in targets]
+            for r in self.results:
+                detail = r["error"] or (f"+{r['added']} -{r['removed']}" if r["changed"] else "unchanged")
+                self.timings.append(("target", r["seconds"], f"{r['path']}: {detail}"))
+
+    def _write(self, plan, entries, writes):
+        # No helper on Windows (see helper.SUPPORTED): the setting is ignored there.
+        if self.hosts_path == HOSTS_PATH and sys.platform != 'win32' and load_settings()["use_helper"]:
+            from helper import HelperClient, start_helper
+            paths = [r["path"] for r in writes]
+            with self.span("helper_connect"):
+                client = HelperClient()
+                info = client.ping()
+                if not info or not set(paths) <= set(info.get("targets", [])):
+                    # Not running, or started before these extra files were configured.
+                    try:
+                        if info:
+                            client.shutdown()
+                        client = start_helper(targets=self._target_paths(load_settings()))
+                    except Exception:
+                        client = None
+            if client is not None:
+                with self.span("helper_request"):
+                    reply = client.apply(entries, paths) if entries is not None else client.remove(paths)
+                self.timings.extend((f"helper:{name}", sec, detail) for name, sec, detail in reply["timings"])
+                by_path = {r["path"]: r for r in reply.get("targets", [])}
+                for r in writes:
+                    done = by_path.get(r["path"], {"error": "not written by the helper"})
+                    r.update(changed=bool(done.get("changed")), error=done.get("error"))
+                return
+            # Helper refused or unreachable: one-shot elevation still works.
+        self._apply(plan, writes)
+
+    def _elevated_spans(self, total, l_path):
+        # The elevated script reports its own swap/flush durations; the rest is the prompt and process start.
+        try:
+            with open(l_path, 'r', encoding='utf-8-sig') as f:
+                swap_s, flush_s = (float(v.replace(',', '.')) for v in f.read().split()[:2])
+        except (OSError, ValueError):
+            self.timings.append(("elevate+swap+flush", total, None))
+            return
+        self.timings.append(("elevate", max(total - swap_s - flush_s, 0.0), None))
+        self.timings.append(("swap", swap_s, None))
+        self.timings.append(("flush", flush_s, None))
+
+    def _apply(self, plan, targets=()):
+        # plan=None: only extra files to write, so no resolver flush and no settle.
+        backend = self.backend or pick_privilege_backend()
+        flushes = []
+        if plan is not None:
+            started = time.perf_counter()
+            flushes = backend.flushes()
+            self.timings.append(("flush_detect", time.perf_counter() - started, ",".join(fs.name for fs in flushes) or "none"))
+        backend.apply(self, plan, flushes, targets)
+        if plan is not None and backend.settle:
+            with self.span("settle"):
+                time.sleep(backend.settle)
+
+APPLY_ACTIONS = ("install", "update")
+
+class OperationTicket:
+    def __init__(self, action, source="user"):
+        self.action = action
+        self.source = source
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+        # pending -> running -> done / failed / cancelled; "coalesced" when folded away before it ran.
+        self.status = "pending"
+        self.error = None
+        self.op = None
+        self.merged = 0
+        # Set when an optional source of this run landed after the run stopped waiting for it.
+        self.late = False
+        # Set on an uninstall that stopped the running apply when it was queued.
+        self.stopped_apply = False
+
+    @property
+    def wait(self):
+        return None if self.started is None else self.started - self.submitted
+
+class OperationQueue:
+    # Serializes every hosts mutation on one worker thread. Requests that the queue would redo or
+    # undo before they start are folded together, so a burst of clicks costs at most one rewrite.
+    # Callbacks run on the worker thread (or on the caller's, for requests folded away at submit).
+    def __init__(self, factory=HostsOperation, on_started=None, on_finished=None, idle_timeout=30.0):
+        self.factory = factory
+        self.on_started = on_started
+        self.on_finished = on_finished
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.pending = []
+        self.running = None
+        self._thread = None
+
+    def depth(self):
+        with self.lock:
+            return len(self.pending) + (self.running is not None)
+
+    @property
+    def busy(self):
+        return self.depth() > 0
+
+    def intent(self):
+        # The action that will have run last once the queue drains; None when idle.
+        with self.lock:
+            last = self.pending[-1] if self.pending else self.running
+            return last.action if last else None
+
+    def submit(self, action, source="user"):
+        ticket = OperationTicket(action, source)
+        folded = []
+        with self.lock:
+            running = self.running
+            same = lambda other: (other.action in APPLY_ACTIONS) == (action in APPLY_ACTIONS)
+            # Each step either settles the request or drops the queued tail, and then the new tail
+            # is checked again: "update, uninstall, update" ends with nothing queued.
+            while True:
+                last = self.pending[-1] if self.pending else None
+                if last is not None and same(last):
+                    # update+update, install+update, uninstall+uninstall: the queued request covers this one.
+                    last.merged += 1
+                    ticket = last
+                    break
+                if last is not None and last.action == "uninstall":
+                    # uninstall then install/update before either started: nothing to do, unless the
+                    # uninstall already stopped the running apply, so the state to restore is gone
+                    # (whether or not that apply has finished since).
+                    self.pending.pop()
+                    folded.append(last)
+                    if last.stopped_apply:
+                        continue
+                    folded.append(ticket)
+                    break
+                if last is not None:
+                    self.pending.pop()
+                    folded.append(last)
+                    if last.action == "install":
+                        # install then uninstall before either started: nothing to do.
+                        folded.append(ticket)
+                        break
+                    # An update about to be undone is pointless; only the uninstall stays.
+                    continue
+                if running is not None and same(running) and not running.op.cancel.is_set():
+                    running.merged += 1
+                    ticket = running
+                    break
+                if running is not None and running.action in APPLY_ACTIONS and action == "uninstall":
+                    # Stop the download; if nothing was written yet the uninstall is a cheap no-op.
+                    running.op.cancel.set()
+                    ticket.stopped_apply = True
+                self.pending.append(ticket)
+                break
+            if self.pending and self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="geminivpn-ops", daemon=True)
+                self._thread.start()
+            self.wake.notify()
+        for t in folded:
+            self._finish(t, "coalesced")
+        return ticket
+
+    def cancel(self, ticket=None):
+        # ticket=None cancels everything: queued requests are dropped, the running one is stopped
+        # at its next checkpoint (a write already in progress always completes).
+        with self.lock:
+            dropped = [t for t in self.pending if ticket is None or t is ticket]
+            self.pending = [t for t in self.pending if t not in dropped]
+            if self.running is not None and (ticket is None or self.running is ticket):
+                self.running.op.cancel.set()
+        for t in dropped:
+            self._finish(t, "cancelled")
+
+    def _late(self, ticket, name):
+        with self.lock:
+            if self.running is ticket:
+                ticket.late = True
+                return
+        self._follow_up()
+
+    def _follow_up(self):
+        # One more update for a source that landed late. Anything still queued or running either
+        # fetches again or removes the list anyway; a list that is no longer applied stays removed.
+        with self.lock:
+            if self.pending or self.running is not None:
+                return
+        path, check = status_target()
+        if check(path):
+            self.submit("update", "late")
+
+    def _finish(self, ticket, status, error=None):
+        ticket.status = status
+        ticket.error = error
+        ticket.finished = time.monotonic()
+        if self.on_finished:
+            self.on_finished(ticket)
+
+    def _loop(self):
+        while True:
+            with self.lock:
+                while not self.pending:
+                    if not self.wake.wait(self.idle_timeout) and not self.pending:
+                        self._thread = None
+                        return
+                ticket = self.pending.pop(0)
+                ticket.op = self.factory(ticket.action)
+                if ticket.source != "late":
+                    # A source that is always slow would otherwise chain follow-ups forever.
+                    ticket.op.on_late = lambda name, ticket=ticket: self._late(ticket, name)
+                ticket.status = "running"
+                ticket.started = time.monotonic()
+                self.running = ticket
+                behind = len(self.pending)
+            ticket.op.timings.append(("queue_wait", ticket.wait, f"{behind} queued, {ticket.merged} merged"))
+            if self.on_started:
+                self.on_started(ticket)
+            status, error = "done", None
+            try:
+                ticket.op.run()
+            except OperationCancelled:
+                status = "cancelled"
+            except Exception as e:
+                status, error = "failed", str(e)
+            with self.lock:
+                self.running = None
+            self._finish(ticket, status, error)
+            if ticket.late and status == "done":
+                self._follow_up()
+
+class UpdateSchedule:
+    def __init__(self, settings=None, path=None):
+        settings = settings or load_settings()
+        self.path = path or os.path.join(get_data_dir(), "scheduler.json")
+        self.enabled = bool(settings["auto_update"])
+        self.interval = float(settings["update_interval_hours"]) * 3600
+        self.jitter = float(settings["update_jitter"])
+        self.retry_base = float(settings["retry_base_minutes"]) * 60
+        self.last_success = None
+        self.next_run = None
+        self.failures = 0
+        self.last_changed = None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.last_success = state.get("last_success")
+            self.next_run = state.get("next_run")
+            self.failures = int(state.get("failures", 0))
+            self.last_changed = state.get("last_changed")
+        except (OSError, ValueError, TypeError, AttributeError):
+            pass
+        if self.next_run is None:
+            # First start: spread clients out instead of all checking at login.
+            self.next_run = time.time() + random.uniform(60, 900)
+            self.save()
+
+    def save(self):
+        state = {"last_success": self.last_success, "next_run": self.next_run, "failures": self.failures, "last_changed": self.last_changed}
+        try:
+            atomic_write(self.path, json.dumps(state))
+        except OSError:
+            pass
+
+    def due(self, now=None):
+        return self.enabled and (now or time.time()) >= self.next_run
+
+    def seconds_until(self, now=None):
+        return max(0.0, self.next_run - (now or time.time()))
+
+    def record_success(self, changed, now=None):
+        now = now or time.time()
+        self.last_success = now
+        self.last_changed = bool(changed)
+        self.failures = 0
+        self.next_run = now + self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        self.save()
+
+    def record_failure(self, now=None):
+        now = now or time.time()
+        self.failures += 1
+        delay = min(self.interval, self.retry_base * 2 ** (self.failures - 1))
+        self.next_run = now + delay * random.uniform(0.5, 1.0)
+        self.save()
+
+def run_scheduled_update(schedule):
+    # Only refreshes an existing install; a disconnected machine stays disconnected.
+    path, check = status_target()
+    if not check(path):
+        schedule.record_success(False)
+        return None
+    op = HostsOperation("update")
+    try:
+        plan = op.run()
+    except Exception:
+        schedule.record_failure()
+        raise
+    schedule.record_success(plan.changed)
+    return op
\ No newline at end of file
@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import hashlib
+from urllib.error import HTTPError, URLError
+from urllib.parse import urljoin
+
+from core import (CHUNK_SIZE, SourceCache, atomic_write, dedupe_entries, entries_digest, fetch_sources, get_data_dir, iter_hosts_entries,
+                  load_sources, safe_remove, snapshot_digest, snapshot_entries, write_snapshot)
+
+# A published list is a directory: index.json, latest.snap (the current merged list, also what the app
+# bundles as baseline.snap) and one patch per version step. A version is identified by the digest of its
+# entries, the same digest the snapshot header carries, so a client finds its place in the chain without
+# any extra state.
+PATCH_MAGIC = "# GeminiVPN delta"
+KEEP_PATCHES = 60
+
+class DeltaUnavailable(ValueError):
+    pass
+
+def base_path():
+    return os.path.join(get_data_dir(), "lists.snap")
+
+def bundled_baseline():
+    return os.path.join(getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__))), "baseline.snap")
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def diff_entries(old, new):
+    old, new = set(old), set(new)
+    return sorted(old - new), sorted(new - old)
+
+def iter_patch(base_version, version, removed, added):
+    yield f"{PATCH_MAGIC} {base_version} {version}\n"
+    for ip, name in removed:
+        yield f"- {ip} {name}\n"
+    for ip, name in added:
+        yield f"+ {ip} {name}\n"
+
+def apply_patch(entries, lines, base_version, version):
+    # Applies in place to a set of (ip, name). A removal of something that is not there means the
+    # patch was made against another list: the chain is broken, not silently patched over.
+    lines = iter(lines)
+    if next(lines, "").split() != PATCH_MAGIC.split() + [str(base_version), str(version)]:
+        raise DeltaUnavailable(f"patch {base_version}->{version}: bad header")
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+        if len(parts) != 3 or parts[0] not in "+-":
+            raise DeltaUnavailable(f"patch {base_version}->{version}: bad line {line.strip()!r}")
+        entry = (parts[1], parts[2])
+        if parts[0] == "+":
+            entries.add(entry)
+        elif entry in entries:
+            entries.remove(entry)
+        else:
+            raise DeltaUnavailable(f"patch {base_version}->{version}: {entry[1]} is not in the base list")
+    return entries
+
+def publish(out_dir, entries, keep=KEEP_PATCHES):
+    # Producer side. Returns (index, changed); the index is written last, so a client never sees
+    # an index that points at files which are not there yet.
+    os.makedirs(out_dir, exist_ok=True)
+    index_path = os.path.join(out_dir, "index.json")
+    latest = os.path.join(out_dir, "latest.snap")
+    entries = list(dedupe_entries(entries))
+    digest = entries_digest(entries).hex()
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = None
+    if index and index["digest"] == digest:
+        return index, False
+    patches = []
+    stale = []
+    version = 1
+    if index:
+        version = index["version"] + 1
+        prev = snapshot_digest(latest)
+        if prev is not None and prev.hex() == index["digest"]:
+            patches = index["patches"]
+            removed, added = diff_entries(snapshot_entries(latest), entries)
+            name = f"{version - 1}-{version}.patch"
+            atomic_write(os.path.join(out_dir, name), "".join(iter_patch(version - 1, version, removed, added)))
+            patches.append({"from": version - 1, "to": version, "base": index["digest"], "digest": digest,
+                            "path": name, "sha256": file_sha256(os.path.join(out_dir, name)), "removed": len(removed), "added": len(added)})
+        else:
+            # latest.snap is missing or stale: start a new chain, old clients fall back to a full fetch.
+            stale = index["patches"]
+    dropped = stale + (patches[:-keep] if keep else patches)
+    patches = patches[-keep:] if keep else []
+    write_snapshot(entries, latest)
+    index = {"format": 1, "version": version, "digest": digest, "entries": len(entries), "patches": patches}
+    atomic_write(index_path, json.dumps(index, indent=1))
+    for p in dropped:
+        safe_remove(os.path.join(out_dir, p["path"]))
+    return index, True
+
+def publish_main(out_dir, keep=KEEP_PATCHES):
+    parts = fetch_sources(load_sources())
+    return publish(out_dir, iter_hosts_entries(line for part in parts for line in part), keep)
+
+def find_chain(index, digest):
+    by_base = {p["base"]: p for p in index["patches"]}
+    steps = []
+    while digest != index["digest"]:
+        p = by_base.get(digest)
+        if p is None or len(steps) >= len(index["patches"]):
+            return None
+        steps.append(p)
+        digest = p["digest"]
+    return steps
+
+def sync_lists(index_url, cache=None, base=None, bundled=None, timeout=5, cancel=None):
+    # Consumer side. Brings the local base (or, on a fresh machine, the bundled baseline) up to the
+    # published version and returns (entries, detail). Raises DeltaUnavailable when there is no
+    # verified path from what we have to what is published; the caller then does a full fetch.
+    cache = cache or SourceCache()
+    base = base or base_path()
+    index = json.loads(cache.fetch(index_url, timeout, cancel))
+    if index.get("format") != 1:
+        raise DeltaUnavailable(f"unsupported index format {index.get('format')!r}")
+    for path in (base, bundled or bundled_baseline()):
+        digest = snapshot_digest(path)
+        steps = None if digest is None else find_chain(index, digest.hex())
+        if steps is not None:
+            break
+    else:
+        raise DeltaUnavailable(f"no patch chain to version {index['version']}")
+    entries = set(snapshot_entries(path))
+    size = 0
+    for p in steps:
+        url = urljoin(index_url, p["path"])
+        try:
+            patch = cache.fetch_file(url, timeout, cancel)
+        except HTTPError as e:
+            if e.code not in (404, 410):
+                raise
+            raise DeltaUnavailable(f"patch {p['from']}->{p['to']}: {e.code} (pruned?)")
+        except URLError as e:
+            # file:// (and other local) indexes report a missing patch this way.
+            if not isinstance(e.reason, FileNotFoundError):
+                raise
+            raise DeltaUnavailable(f"patch {p['from']}->{p['to']}: missing")
+        try:
+            if file_sha256(patch) != p["sha256"]:
+                raise DeltaUnavailable(f"patch {p['from']}->{p['to']}: sha256 mismatch")
+            size += os.path.getsize(patch)
+            with open(patch, 'r', encoding='utf-8') as f:
+                apply_patch(entries, f, p["from"], p["to"])
+        finally:
+            # Patches are applied once; keeping them would only grow the cache.
+            cache.discard(url)
+    if entries_digest(entries).hex() != index["digest"]:
+        raise DeltaUnavailable(f"version {index['version']}: digest mismatch after patching")
+    entries = sorted(entries)
+    if steps or path != base:
+        write_snapshot(entries, base)
+    return entries, f"v{index['version']}, {len(steps)} patches, {size} B"
\ No newline at end of file
@@ -0,0 +1,221 @@
+import time
+import struct
+import asyncio
+import ipaddress
+from collections import OrderedDict
+
+from core import hosts_signature, load_settings, parse_addr, snapshot_entries, snapshot_path
+
+QTYPE_A = 1
+QTYPE_AAAA = 28
+HEADER = struct.Struct("!HHHHHH")
+RR_FIXED = struct.Struct("!HHIH")
+
+def parse_query(data):
+    _, flags, qdcount, _, _, _ = HEADER.unpack_from(data, 0)
+    if qdcount != 1 or flags & 0x8000:
+        raise ValueError("not a single-question query")
+    labels = []
+    off = 12
+    while True:
+        ln = data[off]
+        off += 1
+        if ln == 0:
+            break
+        if ln & 0xC0:
+            raise ValueError("compressed qname in query")
+        labels.append(data[off:off + ln])
+        off += ln
+    qtype, qclass = struct.unpack_from("!HH", data, off)
+    name = b".".join(labels).decode("ascii", "replace").lower()
+    return flags, name, qtype, qclass, off + 4
+
+def build_answer(query, qend, flags, ips, qtype, ttl):
+    resp_flags = 0x8000 | 0x0400 | (flags & 0x0100) | 0x0080
+    answers = []
+    for ip in ips:
+        rdata = ipaddress.ip_address(ip).packed
+        answers.append(struct.pack("!H", 0xC00C) + RR_FIXED.pack(qtype, 1, ttl, len(rdata)) + rdata)
+    return query[:2] + struct.pack("!HHHHH", resp_flags, 1, len(answers), 0, 0) + query[12:qend] + b"".join(answers)
+
+def build_servfail(query):
+    flags, _, _, _, qend = parse_query(query)
+    resp_flags = 0x8000 | (flags & 0x0100) | 0x0080 | 2
+    return query[:2] + struct.pack("!HHHHH", resp_flags, 1, 0, 0, 0) + query[12:qend]
+
+def skip_name(data, off):
+    while True:
+        ln = data[off]
+        if ln == 0:
+            return off + 1
+        if ln & 0xC0 == 0xC0:
+            return off + 2
+        off += ln + 1
+
+def response_ttl(data, negative_ttl=30):
+    # Minimum TTL over answer and authority records; None when the response should not be cached.
+    _, flags, qdcount, ancount, nscount, _ = HEADER.unpack_from(data, 0)
+    if flags & 0x0200 or (flags & 0xF) not in (0, 3):
+        return None
+    off = 12
+    for _ in range(qdcount):
+        off = skip_name(data, off) + 4
+    ttls = []
+    for _ in range(ancount + nscount):
+        off = skip_name(data, off)
+        _, _, ttl, rdlen = RR_FIXED.unpack_from(data, off)
+        off += RR_FIXED.size + rdlen
+        ttls.append(ttl)
+    return min(ttls) if ttls else negative_ttl
+
+class _UpstreamUdp(asyncio.DatagramProtocol):
+    def __init__(self, fut):
+        self.fut = fut
+
+    def datagram_received(self, data, addr):
+        if not self.fut.done():
+            self.fut.set_result(data)
+
+    def error_received(self, exc):
+        if not self.fut.done():
+            self.fut.set_exception(exc)
+
+class DnsStub:
+    def __init__(self, upstream=("1.1.1.1", 53), ttl=300, cache_size=4096, timeout=2.0, snapshot=None, idle_timeout=10.0):
+        self.upstream = upstream
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.timeout = timeout
+        # A TCP client that sends nothing for this long is disconnected.
+        self.idle_timeout = idle_timeout
+        self.snapshot = snapshot or snapshot_path()
+        self.index = {}
+        self.cache = OrderedDict()
+        self._sig = None
+
+    def load(self, entries):
+        index = {}
+        for ip, name in entries:
+            index.setdefault(name, []).append(ip)
+        # A single reference swap: queries in flight keep using the old index.
+        self.index = index
+
+    def reload(self):
+        sig = hosts_signature(self.snapshot)
+        if sig == self._sig:
+            return False
+        self._sig = sig
+        self.load(snapshot_entries(self.snapshot))
+        return True
+
+    def lookup_local(self, query):
+        flags, name, qtype, qclass, qend = parse_query(query)
+        ips = self.index.get(name.rstrip("."))
+        if ips is None or qclass != 1:
+            return None, (name, qtype, qclass)
+        want = 4 if qtype == QTYPE_A else 6 if qtype == QTYPE_AAAA else None
+        matched = [ip for ip in ips if want and (6 if ":" in ip else 4) == want]
+        return build_answer(query, qend, flags, matched, qtype, self.ttl), None
+
+    async def resolve(self, query):
+        try:
+            local, key = self.lookup_local(query)
+        except (ValueError, IndexError, struct.error):
+            return None
+        if local is not None:
+            return local
+        hit = self.cache.get(key)
+        if hit and hit[0] > time.monotonic():
+            self.cache.move_to_end(key)
+            return query[:2] + hit[1][2:]
+        resp = await self.forward(query)
+        if resp is None:
+            # Upstream unreachable or silent: answer SERVFAIL (never cached) instead of leaving the client to time out.
+            return build_servfail(query)
+        try:
+            ttl = response_ttl(resp)
+        except (IndexError, struct.error):
+            ttl = None
+        if ttl:
+            self.cache[key] = (time.monotonic() + ttl, resp)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return resp
+
+    async def forward(self, query):
+        # UDP first whatever the client used; TCP only when upstream truncates.
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        try:
+            transport, _ = await loop.create_datagram_endpoint(lambda: _UpstreamUdp(fut), remote_addr=self.upstream)
+        except OSError:
+            # No route, unresolvable or unusable dns_upstream.
+            return None
+        try:
+            transport.sendto(query)
+            resp = await asyncio.wait_for(fut, self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            return None
+        finally:
+            transport.close()
+        if not HEADER.unpack_from(resp, 0)[1] & 0x0200:
+            return resp
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(*self.upstream), self.timeout)
+            try:
+                writer.write(struct.pack("!H", len(query)) + query)
+                ln = struct.unpack("!H", await asyncio.wait_for(reader.readexactly(2), self.timeout))[0]
+                return await asyncio.wait_for(reader.readexactly(ln), self.timeout)
+            finally:
+                writer.close()
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return None
+
+    async def serve(self, host="127.0.0.1", port=53, reload_interval=2.0):
+        loop = asyncio.get_running_loop()
+        stub = self
+
+        class UdpServer(asyncio.DatagramProtocol):
+            def connection_made(self, transport):
+                self.transport = transport
+
+            def datagram_received(self, data, addr):
+                loop.create_task(self.answer(data, addr))
+
+            async def answer(self, data, addr):
+                resp = await stub.resolve(data)
+                if resp is not None:
+                    self.transport.sendto(resp, addr)
+
+        async def tcp_client(reader, writer):
+            try:
+                while True:
+                    ln = struct.unpack("!H", await asyncio.wait_for(reader.readexactly(2), stub.idle_timeout))[0]
+                    resp = await stub.resolve(await asyncio.wait_for(reader.readexactly(ln), stub.idle_timeout))
+                    if resp is None:
+                        break
+                    writer.write(struct.pack("!H", len(resp)) + resp)
+                    await writer.drain()
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                pass
+            finally:
+                writer.close()
+
+        self.reload()
+        udp, _ = await loop.create_datagram_endpoint(UdpServer, local_addr=(host, port))
+        self.bound = udp.get_extra_info("sockname")[:2]
+        tcp = await asyncio.start_server(tcp_client, host, self.bound[1])
+        try:
+            while True:
+                # Hot reload: a new snapshot from install/update is picked up without any cache flush.
+                await asyncio.sleep(reload_interval)
+                self.reload()
+        finally:
+            udp.close()
+            tcp.close()
+
+def serve_main(listen=None, upstream=None):
+    settings = load_settings()
+    host, port = parse_addr(listen or settings["dns_listen"], 53)
+    stub = DnsStub(parse_addr(upstream or settings["dns_upstream"], 53))
+    asyncio.run(stub.serve(host, port))
\ No newline at end of file
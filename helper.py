@@ -0,0 +1,222 @@
+import os
+import re
+import sys
+import json
+import time
+import secrets
+import threading
+import ipaddress
+import subprocess
+from multiprocessing.connection import Listener, Client
+
+from core import HOSTS_PATH, atomic_write, dedupe_entries, get_data_dir, pick_flush_strategies, plan_hosts, read_hosts
+
+# Requests are length-prefixed JSON over an authenticated local Unix socket; nothing is ever unpickled.
+# Not on Windows: a named pipe created by an elevated process gets a DACL a normal client may not
+# open, and the one-shot elevation in core.py already covers that platform.
+SUPPORTED = sys.platform != 'win32'
+MAX_MESSAGE = 64 * 1024 * 1024
+MAX_ENTRIES = 1000000
+NAME_RE = re.compile(r"(?=.{1,253}\Z)[a-z0-9_*]([a-z0-9_-]{0,62})(\.[a-z0-9_]([a-z0-9_-]{0,62}))*\.?")
+
+def default_address():
+    # A root-owned directory: the root helper must not create or chown anything in a directory the
+    # user can write to, where the socket path could be swapped for a symlink.
+    run_dir = "/run" if os.path.isdir("/run") else "/var/run"
+    return os.path.join(run_dir, f"geminivpn-helper-{os.getuid()}.sock")
+
+def default_key_path():
+    return os.path.join(get_data_dir(), "helper.key")
+
+def read_key(path=None):
+    with open(path or default_key_path(), 'rb') as f:
+        return f.read().strip()
+
+def ensure_key(path=None):
+    path = path or default_key_path()
+    try:
+        return read_key(path)
+    except OSError:
+        pass
+    key = secrets.token_hex(32).encode()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+def validate_entries(entries):
+    if not isinstance(entries, list) or len(entries) > MAX_ENTRIES:
+        raise ValueError("entries must be a list of at most %d items" % MAX_ENTRIES)
+    out = []
+    for item in entries:
+        if not isinstance(item, (list, tuple)) or len(item) != 2:
+            raise ValueError(f"bad entry: {item!r}")
+        ip, name = item
+        if not isinstance(ip, str) or not isinstance(name, str):
+            raise ValueError(f"bad entry: {item!r}")
+        ipaddress.ip_address(ip)
+        if not NAME_RE.fullmatch(name):
+            raise ValueError(f"bad host name: {name!r}")
+        out.append((ip, name))
+    # plan_hosts counts matches, so repeated entries would hide removals.
+    return list(dedupe_entries(out))
+
+class HelperServer:
+    def __init__(self, address, key, hosts_path=HOSTS_PATH, owner=None, idle_timeout=0, targets=()):
+        self.address = address
+        self.key = key
+        self.hosts_path = hosts_path
+        # Extra hosts files fixed at start: a request can pick among them, never name a new path.
+        self.targets = list(targets)
+        self.owner = owner
+        self.idle_timeout = idle_timeout
+        self._idle = None
+        self._stop = False
+
+    def handle(self, req):
+        cmd = req.get("cmd")
+        if cmd == "ping":
+            return {"ok": True, "pid": os.getpid(), "hosts_path": self.hosts_path, "targets": self.targets}
+        if cmd == "shutdown":
+            self._stop = True
+            return {"ok": True}
+        if cmd not in ("apply", "remove"):
+            raise ValueError(f"unknown command: {cmd!r}")
+        entries = validate_entries(req.get("entries")) if cmd == "apply" else None
+        targets = req.get("targets") or []
+        if not isinstance(targets, list):
+            raise ValueError("targets must be a list")
+        timings = []
+        started = time.perf_counter()
+        plan = plan_hosts(read_hosts(self.hosts_path), entries)
+        if plan.changed:
+            atomic_write(self.hosts_path, plan.chunks())
+            timings.append(("swap", time.perf_counter() - started, None))
+            for fs in pick_flush_strategies():
+                started = time.perf_counter()
+                fs.run()
+                timings.append(("flush", time.perf_counter() - started, fs.name))
+        # Only after the main file is in place; each extra file fails on its own.
+        results = [self._write_target(path, entries) for path in targets]
+        return {"ok": True, "changed": plan.changed, "added": len(plan.added), "removed": len(plan.removed), "timings": timings, "targets": results}
+
+    def _write_target(self, path, entries):
+        result = {"path": path, "changed": False, "error": None}
+        try:
+            if path not in self.targets:
+                raise PermissionError("not a target this helper was started for")
+            if not os.path.isfile(path):
+                raise FileNotFoundError("no such hosts file")
+            plan = plan_hosts(read_hosts(path), entries)
+            if plan.changed:
+                atomic_write(path, plan.chunks())
+            result["changed"] = plan.changed
+        except Exception as e:
+            result["error"] = str(e)
+        return result
+
+    def _arm_idle(self):
+        if not self.idle_timeout:
+            return
+        if self._idle:
+            self._idle.cancel()
+        self._idle = threading.Timer(self.idle_timeout, os._exit, args=(0,))
+        self._idle.daemon = True
+        self._idle.start()
+
+    def serve(self):
+        if not SUPPORTED:
+            raise RuntimeError("the privileged helper is not supported on this platform")
+        if os.geteuid() == 0:
+            st = os.stat(os.path.dirname(os.path.abspath(self.address)))
+            if st.st_uid != 0 or st.st_mode & 0o022:
+                raise PermissionError(f"{self.address}: the socket directory must be owned and writable by root only")
+        if os.path.lexists(self.address):
+            os.remove(self.address)
+        # Created 0600 from the start instead of chmod-ed by path afterwards.
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, authkey=self.key)
+        finally:
+            os.umask(umask)
+        if self.owner is not None:
+            os.chown(self.address, self.owner, -1, follow_symlinks=False)
+        self._arm_idle()
+        try:
+            while not self._stop:
+                try:
+                    conn = listener.accept()
+                except Exception:
+                    # Failed authentication or a client that went away mid-handshake.
+                    continue
+                with conn:
+                    self._arm_idle()
+                    try:
+                        req = json.loads(conn.recv_bytes(MAX_MESSAGE))
+                        reply = self.handle(req)
+                    except Exception as e:
+                        reply = {"ok": False, "error": str(e)}
+                    try:
+                        conn.send_bytes(json.dumps(reply).encode())
+                    except OSError:
+                        pass
+        finally:
+            listener.close()
+
+class HelperClient:
+    def __init__(self, address=None, key_path=None):
+        self.address = address or default_address()
+        self.key_path = key_path or default_key_path()
+
+    def request(self, req):
+        with Client(self.address, authkey=read_key(self.key_path)) as conn:
+            conn.send_bytes(json.dumps(req).encode())
+            reply = json.loads(conn.recv_bytes(MAX_MESSAGE))
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error") or "helper request failed")
+        return reply
+
+    def ping(self):
+        try:
+            return self.request({"cmd": "ping"})
+        except Exception:
+            return None
+
+    def apply(self, entries, targets=()):
+        return self.request({"cmd": "apply", "entries": [list(e) for e in entries], "targets": list(targets)})
+
+    def remove(self, targets=()):
+        return self.request({"cmd": "remove", "targets": list(targets)})
+
+    def shutdown(self):
+        return self.request({"cmd": "shutdown"})
+
+def helper_command():
+    if getattr(sys, 'frozen', False):
+        return [sys.executable, "helper", "serve"]
+    return [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py"), "helper", "serve"]
+
+def start_helper(address=None, key_path=None, hosts_path=HOSTS_PATH, wait=30.0, targets=()):
+    # One elevation prompt; afterwards every apply/remove is a local socket round-trip.
+    if not SUPPORTED:
+        raise RuntimeError("the privileged helper is not supported on this platform")
+    client = HelperClient(address, key_path)
+    ensure_key(client.key_path)
+    args = helper_command() + ["--address", client.address, "--key-file", client.key_path, "--hosts", hosts_path, "--owner", str(os.getuid())]
+    for path in targets:
+        args += ["--target", path]
+    cmd = " ".join(f"'{a}'" for a in args)
+    launcher = [] if os.geteuid() == 0 else ["pkexec"]
+    subprocess.run(launcher + ["sh", "-c", f"nohup {cmd} >/dev/null 2>&1 &"], check=True)
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        if client.ping():
+            return client
+        time.sleep(0.1)
+    raise TimeoutError("privileged helper did not come up")
+
+def serve_main(args):
+    # The key file belongs to the user who started the helper; it is read once and never rewritten here.
+    key = read_key(args.key_file)
+    HelperServer(args.address or default_address(), key, args.hosts, args.owner, args.idle_timeout, args.target or ()).serve()
+    return 0
\ No newline at end of file
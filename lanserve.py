@@ -0,0 +1,105 @@
+import gzip
+import time
+import asyncio
+import hashlib
+from email.utils import formatdate
+
+from core import dedupe_entries, fetch_sources, iter_hosts_entries, load_settings, load_sources, parse_addr, render_managed_block
+
+MAX_HEADER = 16 * 1024
+
+class Payload:
+    def __init__(self, text, entries):
+        self.body = text.encode("utf-8")
+        self.gzip = gzip.compress(self.body, 6)
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+        self.entries = entries
+        self.modified = formatdate(time.time(), usegmt=True)
+
+def build_payload(sources=None):
+    # Merged and deduplicated once here; every client gets the same bytes (and the same ETag).
+    parts = fetch_sources(sources or load_sources())
+    entries = list(dedupe_entries(iter_hosts_entries(line for part in parts for line in part)))
+    if not entries:
+        raise ValueError("upstream lists are empty")
+    return Payload("\n".join(render_managed_block(entries)[1:-1]) + "\n", len(entries))
+
+class ListServer:
+    def __init__(self, refresh=3600, sources=None, timeout=10.0):
+        self.refresh = refresh
+        self.sources = sources
+        self.timeout = timeout
+        self.payload = None
+        self.served = 0
+        self.not_modified = 0
+
+    async def reload(self):
+        payload = await asyncio.get_running_loop().run_in_executor(None, build_payload, self.sources)
+        if self.payload is None or payload.etag != self.payload.etag:
+            self.payload = payload
+        return self.payload
+
+    def response(self, path, headers):
+        payload = self.payload
+        if path in ("/health", "/health/"):
+            body = f'{{"ok": {"true" if payload else "false"}, "entries": {payload.entries if payload else 0}}}'.encode()
+            return 200 if payload else 503, {"Content-Type": "application/json"}, body
+        if path not in ("/", "/hosts"):
+            return 404, {"Content-Type": "text/plain"}, b"not found\n"
+        if payload is None:
+            return 503, {"Content-Type": "text/plain", "Retry-After": "30"}, b"lists not fetched yet\n"
+        common = {"ETag": payload.etag, "Last-Modified": payload.modified, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+        if payload.etag in [t.strip() for t in headers.get("if-none-match", "").split(",")]:
+            self.not_modified += 1
+            return 304, common, b""
+        self.served += 1
+        if "gzip" in headers.get("accept-encoding", ""):
+            return 200, dict(common, **{"Content-Type": "text/plain; charset=utf-8", "Content-Encoding": "gzip"}), payload.gzip
+        return 200, dict(common, **{"Content-Type": "text/plain; charset=utf-8"}), payload.body
+
+    async def handle(self, reader, writer):
+        # One request per connection: clients fetch once per update, keep-alive would only hold sockets open.
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.timeout)
+            lines = head[:MAX_HEADER].decode("latin-1").split("\r\n")
+            method, path, _ = lines[0].split(" ", 2)
+            headers = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    k, v = line.split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+            if method not in ("GET", "HEAD"):
+                status, out, body = 405, {"Allow": "GET, HEAD"}, b""
+            else:
+                status, out, body = self.response(path.split("?", 1)[0], headers)
+            reason = {200: "OK", 304: "Not Modified", 404: "Not Found", 405: "Method Not Allowed", 503: "Service Unavailable"}[status]
+            out["Content-Length"] = str(len(body))
+            out["Connection"] = "close"
+            writer.write((f"HTTP/1.1 {status} {reason}\r\n" + "".join(f"{k}: {v}\r\n" for k, v in out.items()) + "\r\n").encode("latin-1"))
+            if method != "HEAD" and status != 304:
+                writer.write(body)
+            await writer.drain()
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="0.0.0.0", port=8787):
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024, limit=MAX_HEADER)
+        self.bound = server.sockets[0].getsockname()[:2]
+        try:
+            while True:
+                try:
+                    await self.reload()
+                    delay = self.refresh
+                except Exception:
+                    # Keep serving the last good lists; retry sooner than a full refresh period.
+                    delay = min(self.refresh, 300)
+                await asyncio.sleep(delay)
+        finally:
+            server.close()
+
+def serve_main(listen=None, refresh=None):
+    settings = load_settings()
+    host, port = parse_addr(listen or settings["lan_listen"], 8787)
+    asyncio.run(ListServer(refresh=refresh or 3600).serve(host, port))
\ No newline at end of file
@@ -0,0 +1,179 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+# Headless: the real window on Qt's offscreen platform, no display or tray needed.
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+# Importing bench first moves the cache/config dirs into a throwaway home and gives us the list server.
+import bench
+import core
+
+try:
+    from PyQt6.QtCore import QEventLoop, QTimer
+    from PyQt6.QtGui import QIcon
+    from PyQt6.QtWidgets import QApplication
+except ImportError:
+    sys.exit("latency.py needs PyQt6")
+
+import main as gui
+
+SETTLED = {"ПОДКЛЮЧЕНО": True, "ОТКЛЮЧЕНО": False}
+
+class Harness:
+    # Clicks the real GeminiVPN window and times click -> settled status line. Settled means the
+    # operation queue is idle and the window shows ПОДКЛЮЧЕНО/ОТКЛЮЧЕНО again.
+    def __init__(self, app, backend, timeout=30.0):
+        self.app = app
+        self.timeout = timeout
+        self.warnings = 0
+        # A modal box would stall the loop; count it instead of showing it.
+        gui.QMessageBox.warning = lambda *a, **k: self._warned()
+        self.window = gui.GeminiVPN(QIcon())
+        self.window.ops.queue.factory = lambda action: core.HostsOperation(action, backend=backend)
+        self.window.show()
+        self.window.set_primary()
+        self._loop = None
+        self._deadline = QTimer()
+        self._deadline.setSingleShot(True)
+        self._deadline.timeout.connect(self._stop)
+        self.window.ops.finished.connect(self._on_finished)
+        self._spin(lambda: self.window._ready)
+
+    def _warned(self):
+        self.warnings += 1
+
+    def settled(self):
+        return not self.window.ops.queue.busy and self.window.lbl_stat.text() in SETTLED
+
+    @property
+    def connected(self):
+        return SETTLED.get(self.window.lbl_stat.text())
+
+    def _stop(self):
+        if self._loop is not None:
+            self._loop.quit()
+
+    def _on_finished(self, ticket):
+        if self.settled():
+            self._stop()
+
+    def _spin(self, done):
+        deadline = time.monotonic() + self.timeout
+        while not done():
+            if time.monotonic() > deadline:
+                raise TimeoutError("window did not settle")
+            self.app.processEvents()
+            time.sleep(0.001)
+
+    def click(self, handler, times=1):
+        # Returns (seconds, final connected state); every click lands before the first one finishes.
+        warnings = self.warnings
+        started = time.perf_counter()
+        for _ in range(times):
+            handler()
+        if not self.settled():
+            self._loop = QEventLoop()
+            self._deadline.start(int(self.timeout * 1000))
+            self._loop.exec()
+            self._deadline.stop()
+            self._loop = None
+            # Settles on the last finished signal; a deadline hit still gets a short grace period here.
+            self._spin(self.settled)
+        return time.perf_counter() - started, self.connected, self.warnings > warnings
+
+def summarize(samples):
+    ms = [s * 1000 for s in samples]
+    return {
+        "count": len(ms),
+        "p50": round(core.percentile(ms, 0.5), 2) if ms else None,
+        "p95": round(core.percentile(ms, 0.95), 2) if ms else None,
+        "p99": round(core.percentile(ms, 0.99), 2) if ms else None,
+        "max": round(max(ms), 2) if ms else None,
+    }
+
+def run(args):
+    www = os.path.join(bench.BENCH_HOME, "www")
+    os.makedirs(www)
+    with open(os.path.join(www, "hosts"), "w", encoding="utf-8") as f:
+        f.write(bench.synth_hosts(args.lines))
+    srv = bench.serve(www)
+    config = core.get_config_dir()
+    with open(os.path.join(config, "sources.json"), "w", encoding="utf-8") as f:
+        json.dump([{"name": "synthetic", "url": f"http://127.0.0.1:{srv.server_port}/hosts", "required": True}], f)
+    core.save_settings({"auto_update": False, "probe_ips": False})
+    core.HOSTS_PATH = os.path.join(bench.BENCH_HOME, "hosts")
+    with open(core.HOSTS_PATH, "w", encoding="utf-8") as f:
+        f.write(core.DEFAULT_HOSTS)
+
+    backend = core.FakeBackend(args.elevate, args.flush, args.jitter, args.failure_rate, seed=args.seed)
+    app = QApplication([sys.argv[0]])
+    harness = Harness(app, backend)
+    w = harness.window
+    samples = {"connect": [], "update": [], "disconnect": [], "burst": []}
+    failed = {k: 0 for k in samples}
+    mismatches = 0
+
+    def measure(name, handler, times=1):
+        took, state, warned = harness.click(handler, times)
+        samples[name].append(took)
+        failed[name] += warned
+        return state, warned
+
+    try:
+        for i in range(args.cycles):
+            if harness.connected:
+                measure("disconnect", w._handle_main_btn)
+            if not harness.connected and measure("connect", w._handle_main_btn)[0]:
+                measure("update", w._handle_update_btn)
+                measure("disconnect", w._handle_main_btn)
+            if args.burst:
+                # Rapid toggles: an odd count must end connected, an even one where it started.
+                before = harness.connected
+                state, warned = measure("burst", w._handle_main_btn, args.burst)
+                if not warned and state != (before ^ (args.burst % 2 == 1)):
+                    mismatches += 1
+            if (i + 1) % 50 == 0:
+                print(f"{i + 1}/{args.cycles} cycles", file=sys.stderr)
+    finally:
+        w.ops.queue.cancel()
+        srv.shutdown()
+    return {
+        "cycles": args.cycles,
+        "lines": args.lines,
+        "backend": {"elevate": args.elevate, "flush": args.flush, "jitter": args.jitter, "failure_rate": args.failure_rate},
+        "latency_ms": {k: summarize(v) for k, v in samples.items() if v},
+        "failed": failed,
+        "burst_mismatches": mismatches,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GeminiVPN click-to-status latency harness (offscreen Qt, fake privilege backend)")
+    parser.add_argument("--cycles", type=int, default=200, help="connect/update/disconnect/burst rounds")
+    parser.add_argument("--lines", type=int, default=10000, help="size of the synthetic upstream list")
+    parser.add_argument("--elevate", type=float, default=0.05, help="seconds the fake elevation prompt takes")
+    parser.add_argument("--flush", type=float, default=0.01, help="seconds the fake resolver flush takes")
+    parser.add_argument("--jitter", type=float, default=0.2, help="+/- fraction applied to both delays")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of elevations that fail")
+    parser.add_argument("--burst", type=int, default=3, help="clicks per rapid-toggle round (0 to skip)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report to this file as well")
+    parser.add_argument("--max-p95", type=float, help="exit 1 if any scenario's p95 exceeds this many ms")
+    args = parser.parse_args(argv)
+    try:
+        report = run(args)
+    finally:
+        bench.shutil.rmtree(bench.BENCH_HOME, ignore_errors=True)
+    data = json.dumps(report, indent=2, ensure_ascii=False)
+    print(data)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(data)
+    if args.max_p95 is not None and any(s["p95"] > args.max_p95 for s in report["latency_ms"].values()):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -1,20 +1,17 @@
 import sys
 import os
-import ctypes
-import traceback
 import time
-import tempfile
-import urllib.request
-import urllib.error
-import subprocess
-import shutil
-from datetime import datetime
-from pathlib import Path
+
+STARTED = time.perf_counter()
 
 def global_exception_handler(exc_type, exc_value, exc_traceback):
     if issubclass(exc_type, KeyboardInterrupt):
         sys.__excepthook__(exc_type, exc_value, exc_traceback)
         return
+    import ctypes
+    import traceback
+    from datetime import datetime
+    from pathlib import Path
     error_msg = "".join(traceback.format_exception(exc_type, exc_value, exc_traceback))
     log_file = Path(__file__).parent / "crash_log.txt"
     try:
@@ -27,16 +24,24 @@ def global_exception_handler(exc_type, exc_value, exc_traceback):
 
 sys.excepthook = global_exception_handler
 
+if __name__ == "__main__" and any(not arg.startswith("-") for arg in sys.argv[1:]):
+    # Any subcommand (status/install/update/...), wherever the options are, is headless and never loads Qt.
+    from cli import main as cli_main
+    sys.exit(cli_main(sys.argv[1:]))
+
 try:
-    from PyQt6.QtCore import Qt, QTimer, QVariantAnimation, pyqtSignal, QByteArray, QThread, QUrl, QObject
-    from PyQt6.QtGui import QColor, QPainter, QPainterPath, QPen, QIcon, QAction, QDesktopServices
+    from PyQt6.QtCore import Qt, QTimer, QVariantAnimation, pyqtSignal, QByteArray, QUrl, QObject, QFileSystemWatcher, QEvent
+    from PyQt6.QtGui import QColor, QPainter, QPainterPath, QPen, QIcon, QAction, QDesktopServices, QPixmap
     from PyQt6.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QGraphicsOpacityEffect, QSystemTrayIcon, QMenu, QMessageBox
-    from PyQt6.QtSvgWidgets import QSvgWidget
+    from PyQt6.QtSvg import QSvgRenderer
     from PyQt6.QtNetwork import QLocalServer, QLocalSocket
 except ImportError:
     sys.exit(1)
 
-HOSTS_PATH = r"C:\Windows\System32\drivers\etc\hosts" if sys.platform == 'win32' else "/etc/hosts"
+import ctypes
+from collections import OrderedDict
+
+from core import APPLY_ACTIONS, PROFILES, OperationQueue, UpdateSchedule, hosts_signature, load_settings, record_metrics, save_settings, status_target, summarize_metrics
 
 LOGO_SVG = """
 <svg viewBox="0 0 11 11" xmlns="http://www.w3.org/2000/svg">
@@ -71,141 +76,185 @@ class AppConfig:
     GRADIENT_OFF = [QColor("#9168C0"), QColor("#5684D1"), QColor("#1BA1E3")]
     GRADIENT_ON = [QColor("#10B981"), QColor("#059669"), QColor("#047857")]
     GRADIENT_CONN = [QColor("#F59E0B"), QColor("#D97706"), QColor("#B45309")]
+    LOGO_FRAMES = 16
+    SVG_CACHE_SIZE = 96
+    PROFILE_TITLES = {"all": "Все сервисы", "gemini": "Gemini", "chatgpt": "ChatGPT", "claude": "Claude"}
 
 def get_resource_path(relative_path):
     if hasattr(sys, '_MEIPASS'):
         return os.path.join(sys._MEIPASS, relative_path)
     return os.path.join(os.path.abspath("."), relative_path)
 
-def check_installation():
-    if not os.path.exists(HOSTS_PATH):
-        return False
-    try:
-        with open(HOSTS_PATH, 'r', encoding='utf-8', errors='ignore') as f:
-            return "dns.malw.link" in f.read()
-    except:
-        return False
 
-def safe_remove(path):
-    try:
-        if os.path.exists(path):
-            os.remove(path)
-    except:
-        pass
+class StartupProfiler:
+    def __init__(self, started):
+        self.started = started
+        self.marks = []
+        self.reported = False
+
+    def mark(self, name):
+        self.marks.append((name, time.perf_counter() - self.started))
+
+    def elapsed(self, name):
+        return next((sec for n, sec in self.marks if n == name), None)
+
+    def report(self):
+        # Startup records carry no "total", so they stay out of the operation p50/p95.
+        if self.reported:
+            return
+        self.reported = True
+        first_paint, status = self.elapsed("first_paint"), self.elapsed("status")
+        record_metrics({
+            "ts": round(time.time(), 3),
+            "action": "startup",
+            "ok": True,
+            "first_paint": None if first_paint is None else round(first_paint, 4),
+            "status": None if status is None else round(status, 4),
+            "spans": [{"step": n, "seconds": round(sec, 4), "detail": None} for n, sec in self.marks],
+        })
+
+PROFILER = StartupProfiler(STARTED)
 
 class SingleInstance(QObject):
     show_requested = pyqtSignal()
+    resolved = pyqtSignal(bool)
 
     def __init__(self, key):
         super().__init__()
         self.key = key
+        self.is_running = None
         self.server = QLocalServer(self)
         self.socket = QLocalSocket(self)
+        self.socket.connected.connect(lambda: self._resolve(True))
+        self.socket.errorOccurred.connect(lambda _: self._resolve(False))
+        # A hung owner of a stale socket (or a server that never accepts) reports neither signal;
+        # same budget as the old blocking waitForConnected(500).
+        self.deadline = QTimer(self)
+        self.deadline.setSingleShot(True)
+        self.deadline.setInterval(500)
+        self.deadline.timeout.connect(lambda: self._resolve(False))
+
+    def start(self):
+        # Non-blocking: the window shell is painted while the connect attempt is in flight.
+        self.deadline.start()
         self.socket.connectToServer(self.key)
-        self.is_running = self.socket.waitForConnected(500)
-        if not self.is_running:
+
+    def _resolve(self, running):
+        if self.is_running is not None:
+            return
+        self.is_running = running
+        self.deadline.stop()
+        if running:
+            self.socket.disconnectFromServer()
+        else:
+            self.socket.abort()
             QLocalServer.removeServer(self.key)
             self.server.listen(self.key)
             self.server.newConnection.connect(self._handle_connection)
+        self.resolved.emit(running)
 
     def _handle_connection(self):
         client = self.server.nextPendingConnection()
         if client:
-            client.waitForReadyRead(500)
             client.disconnectFromServer()
             self.show_requested.emit()
 
-class HostsWorker(QThread):
-    finished_signal = pyqtSignal(bool, str)
-
-    def __init__(self, action):
-        super().__init__()
-        self.action = action
-
-    def run(self):
-        if self.action in ("install", "update"):
-            self.install()
-        else:
-            self.uninstall()
-
-    def install(self):
-        url = "https://raw.githubusercontent.com/ImMALWARE/dns.malw.link/refs/heads/master/hosts"
-        add_url = "https://raw.githubusercontent.com/AvenCores/Goida-AI-Unlocker/refs/heads/main/additional_hosts.py"
-        t_path = None
-        s_path = None
-        try:
-            t_fd, t_path = tempfile.mkstemp()
-            os.close(t_fd)
-            req1 = urllib.request.Request(f"{url}?t={int(time.time())}", headers={'User-Agent': 'Mozilla/5.0'})
-            content = urllib.request.urlopen(req1, timeout=15).read().decode("utf-8", errors="ignore")
-            try:
-                req2 = urllib.request.Request(f"{add_url}?t={int(time.time())}", headers={'User-Agent': 'Mozilla/5.0'})
-                add_raw = urllib.request.urlopen(req2, timeout=15).read().decode("utf-8", errors="ignore")
-                if 'hosts_add = """' in add_raw:
-                    add_block = add_raw.split('hosts_add = """')[1].split('"""')[0].strip()
-                    if add_block:
-                        content += f"\n{add_block}\n"
-            except:
-                pass
-            with open(t_path, 'w', encoding='utf-8') as f:
-                f.write(content)
-            
-            if sys.platform == 'win32':
-                ps_c = f'$s="{t_path}";$d="{HOSTS_PATH}";Copy-Item -Path $s -Destination $d -Force;Clear-DnsClientCache;ipconfig /flushdns;ipconfig /release;ipconfig /renew;netsh winsock reset'
-                with tempfile.NamedTemporaryFile('w', delete=False, suffix='.ps1', encoding='utf-8') as pf:
-                    pf.write(ps_c)
-                    s_path = pf.name
-                cmd = ["powershell", "-WindowStyle", "Hidden", "-Command", f'Start-Process powershell -Verb runAs -WindowStyle Hidden -ArgumentList \'-NoProfile -ExecutionPolicy Bypass -File "{s_path}"\' -Wait']
-                subprocess.run(cmd, check=True, creationflags=subprocess.CREATE_NO_WINDOW)
-            else:
-                fc = "resolvectl flush-caches || systemd-resolve --flush-caches || /etc/init.d/nscd restart || killall -HUP dnsmasq || true"
-                if os.geteuid() == 0:
-                    shutil.copy(t_path, HOSTS_PATH)
-                    os.chmod(HOSTS_PATH, 0o644)
-                    subprocess.run(fc, shell=True)
-                else:
-                    bc = f"cp '{t_path}' {HOSTS_PATH} && chmod 644 {HOSTS_PATH} && {fc}"
-                    subprocess.run(["pkexec", "bash", "-c", bc], check=True)
-            time.sleep(1)
-            self.finished_signal.emit(True, self.action)
-        except Exception as e:
-            self.finished_signal.emit(False, str(e))
-        finally:
-            if t_path: safe_remove(t_path)
-            if s_path: safe_remove(s_path)
-
-    def uninstall(self):
-        t_path = None
-        s_path = None
-        try:
-            def_h = "127.0.0.1 localhost\n::1 localhost\n"
-            with tempfile.NamedTemporaryFile('w', delete=False, suffix='.txt', encoding='utf-8') as tf:
-                tf.write(def_h)
-                t_path = tf.name
-            
-            if sys.platform == 'win32':
-                ps_c = f'$s="{t_path}";$d="{HOSTS_PATH}";Copy-Item -Path $s -Destination $d -Force;Clear-DnsClientCache;ipconfig /flushdns;ipconfig /release;ipconfig /renew;netsh winsock reset'
-                with tempfile.NamedTemporaryFile('w', delete=False, suffix='.ps1', encoding='utf-8') as pf:
-                    pf.write(ps_c)
-                    s_path = pf.name
-                cmd = ["powershell", "-WindowStyle", "Hidden", "-Command", f'Start-Process powershell -Verb runAs -WindowStyle Hidden -ArgumentList \'-NoProfile -ExecutionPolicy Bypass -File "{s_path}"\' -Wait']
-                subprocess.run(cmd, check=True, creationflags=subprocess.CREATE_NO_WINDOW)
-            else:
-                fc = "resolvectl flush-caches || systemd-resolve --flush-caches || /etc/init.d/nscd restart || killall -HUP dnsmasq || true"
-                if os.geteuid() == 0:
-                    shutil.copy(t_path, HOSTS_PATH)
-                    os.chmod(HOSTS_PATH, 0o644)
-                    subprocess.run(fc, shell=True)
-                else:
-                    bc = f"cp '{t_path}' {HOSTS_PATH} && chmod 644 {HOSTS_PATH} && {fc}"
-                    subprocess.run(["pkexec", "bash", "-c", bc], check=True)
-            time.sleep(1)
-            self.finished_signal.emit(True, "uninstall")
-        except Exception as e:
-            self.finished_signal.emit(False, str(e))
-        finally:
-            if t_path: safe_remove(t_path)
-            if s_path: safe_remove(s_path)
+class HostsStatus(QObject):
+    changed = pyqtSignal(bool)
+
+    def __init__(self, path=None, check=None, parent=None):
+        super().__init__(parent)
+        default_path, default_check = status_target()
+        self.path = path or default_path
+        self.check = check or default_check
+        self._sig = None
+        self.installed = False
+        # mtime of the target as of the last refresh: when the applied lists were last written.
+        self.since = None
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.addPath(os.path.dirname(self.path))
+        self.watcher.fileChanged.connect(self._schedule)
+        self.watcher.directoryChanged.connect(self._schedule)
+        # Collapses bursts of notifications (write + rename) into one stat.
+        self.debounce = QTimer(self)
+        self.debounce.setSingleShot(True)
+        self.debounce.setInterval(200)
+        self.debounce.timeout.connect(self.refresh)
+        # Safety net for filesystems where change notifications are not delivered.
+        self.poll = QTimer(self)
+        self.poll.timeout.connect(self.refresh)
+        self.poll.start(30000)
+        self.refresh()
+
+    def _schedule(self, *_):
+        self.debounce.start()
+
+    def refresh(self):
+        if os.path.exists(self.path) and self.path not in self.watcher.files():
+            self.watcher.addPath(self.path)
+        sig = hosts_signature(self.path)
+        if sig == self._sig:
+            return self.installed
+        self._sig = sig
+        self.since = sig[0] / 1e9 if sig else None
+        verdict = sig is not None and self.check(self.path)
+        if verdict != self.installed:
+            self.installed = verdict
+            self.changed.emit(verdict)
+        return self.installed
+
+class OperationBridge(QObject):
+    # The queue calls back on its worker thread; the signals hand tickets over to the GUI thread.
+    started = pyqtSignal(object)
+    finished = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.queue = OperationQueue(on_started=self.started.emit, on_finished=self._finished)
+
+    def _finished(self, ticket):
+        # Read the metrics log here rather than on the GUI thread.
+        ticket.summary = summarize_metrics() if ticket.op is not None else None
+        self.finished.emit(ticket)
+
+def format_perf(summary):
+    if not summary["count"]:
+        return ""
+    return f"посл. {summary['last']:.1f} с · p50 {summary['p50']:.1f} с · p95 {summary['p95']:.1f} с"
+
+class SvgCache:
+    def __init__(self, limit):
+        self.limit = limit
+        self._items = OrderedDict()
+
+    def pixmap(self, template, size, dpr=1.0, **colors):
+        key = (template, tuple(sorted(colors.items())), size, dpr)
+        pix = self._items.get(key)
+        if pix is not None:
+            self._items.move_to_end(key)
+            return pix
+        pix = QPixmap(round(size * dpr), round(size * dpr))
+        pix.fill(Qt.GlobalColor.transparent)
+        p = QPainter(pix)
+        QSvgRenderer(QByteArray(template.format(**colors).encode())).render(p)
+        p.end()
+        pix.setDevicePixelRatio(dpr)
+        self._items[key] = pix
+        if len(self._items) > self.limit:
+            self._items.popitem(last=False)
+        return pix
+
+SVG_CACHE = SvgCache(AppConfig.SVG_CACHE_SIZE)
+
+def logo_frames(start, end, size, dpr):
+    frames = []
+    n = AppConfig.LOGO_FRAMES
+    for k in range(n + 1):
+        v = k / n
+        cols = [QColor(int(s.red() + (e.red() - s.red()) * v), int(s.green() + (e.green() - s.green()) * v), int(s.blue() + (e.blue() - s.blue()) * v)) for s, e in zip(start, end)]
+        pix = SVG_CACHE.pixmap(LOGO_SVG, size, dpr, c1=cols[0].name(), c2=cols[1].name(), c3=cols[2].name())
+        frames.append((cols, pix))
+    return frames
 
 class ControlBtn(QWidget):
     clicked = pyqtSignal()
@@ -220,14 +269,12 @@ class ControlBtn(QWidget):
         self.setStyleSheet("QWidget { border: 2px solid #1A1A1D; border-radius: 8px; background: transparent; } QWidget:hover { background: #1A1A1D; }")
         layout = QVBoxLayout(self)
         layout.setContentsMargins(6, 6, 6, 6)
-        self.svg = QSvgWidget()
+        self.svg = QLabel()
         self.svg.setStyleSheet("border: none; background: transparent;")
         layout.addWidget(self.svg)
-        self._render(self.normal_hex)
 
     def _render(self, color):
-        data = CTRL_SVG.format(path=self.path_d, color=color)
-        self.svg.load(QByteArray(data.encode()))
+        self.svg.setPixmap(SVG_CACHE.pixmap(CTRL_SVG, 20, self.devicePixelRatioF(), path=self.path_d, color=color))
 
     def enterEvent(self, e):
         self._render(self.hover_hex)
@@ -244,10 +291,15 @@ class GeminiVPN(QWidget):
         super().__init__()
         self._app_icon = app_icon
         self._is_connected = False
-        self._is_processing = False
         self._drag_pos = None
         self.c_cur = [QColor(c) for c in AppConfig.GRADIENT_OFF]
-        self.worker = None
+        self._logo_pix = None
+        self._ready = False
+        self._primary = False
+        self._since = None
+        self.ops = OperationBridge(self)
+        self.ops.started.connect(self._show_busy)
+        self.ops.finished.connect(self._on_op_finished)
         self.donate_url = "https://www.donationalerts.com/r/verloft"
         
         self.setWindowFlags(Qt.WindowType.FramelessWindowHint | Qt.WindowType.WindowSystemMenuHint)
@@ -255,18 +307,46 @@ class GeminiVPN(QWidget):
         self.setFixedSize(AppConfig.WINDOW_WIDTH, AppConfig.WINDOW_HEIGHT)
         self.setWindowIcon(self._app_icon)
         
+        # Only the widget shell is built here; SVGs, tray and the hosts check wait for the first paint.
         self._build_ui()
+
+    def set_primary(self):
+        self._primary = True
+        self._finish_startup()
+
+    def _finish_startup(self):
+        # Runs once both the first frame is on screen and the single-instance check said we own the lock.
+        if self._ready or not self._primary or PROFILER.elapsed("first_paint") is None:
+            return
+        self._ready = True
+        dpr = self.devicePixelRatioF()
+        self._draw_logo()
+        for btn in (self.min_btn, self.close_btn):
+            btn._render(btn.normal_hex)
+        self.h_svg.setPixmap(SVG_CACHE.pixmap(HEART_SVG, 18, dpr, color="#888888"))
+        PROFILER.mark("svg")
+
         self._setup_tray()
-        
+        PROFILER.mark("tray")
+
+        # Only runs while the elapsed time is actually on screen; see _sync_timer().
         self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
         self.timer.timeout.connect(self._update_timer_label)
-        self.timer.start(1000)
 
-        self.check_timer = QTimer(self)
-        self.check_timer.timeout.connect(self._check_status_loop)
-        self.check_timer.start(2000)
-        
+        self.status = HostsStatus(parent=self)
+        self.status.changed.connect(self._on_status_changed)
+
+        self.schedule = UpdateSchedule()
+        self.update_timer = QTimer(self)
+        self.update_timer.setSingleShot(True)
+        self.update_timer.timeout.connect(self._auto_update_tick)
+        self._arm_update_timer()
+
+        self.btn_main.setEnabled(True)
         self._init_state()
+        PROFILER.mark("status")
+        PROFILER.report()
 
     def _build_ui(self):
         root = QVBoxLayout(self)
@@ -280,26 +360,25 @@ class GeminiVPN(QWidget):
         title = QLabel(AppConfig.APP_NAME.upper())
         title.setStyleSheet("color: #555; font-size: 10px; font-weight: 900; letter-spacing: 2px;")
         
-        min_btn = ControlBtn("M5 12h14", "#555555", "#FFFFFF")
-        close_btn = ControlBtn("M18 6L6 18M6 6l12 12", "#555555", "#FF4444")
+        self.min_btn = ControlBtn("M5 12h14", "#555555", "#FFFFFF")
+        self.close_btn = ControlBtn("M18 6L6 18M6 6l12 12", "#555555", "#FF4444")
         
-        min_btn.clicked.connect(self.showMinimized)
-        close_btn.clicked.connect(self.hide)
+        self.min_btn.clicked.connect(self.showMinimized)
+        self.close_btn.clicked.connect(self.hide)
         
         bar_l.addWidget(title)
         bar_l.addStretch()
-        bar_l.addWidget(min_btn)
+        bar_l.addWidget(self.min_btn)
         bar_l.addSpacing(6)
-        bar_l.addWidget(close_btn)
+        bar_l.addWidget(self.close_btn)
         root.addWidget(self.bar)
 
-        self.logo = QSvgWidget()
+        self.logo = QLabel()
         self.logo.setFixedSize(90, 90)
-        self._draw_logo()
         root.addSpacing(10)
         root.addWidget(self.logo, alignment=Qt.AlignmentFlag.AlignCenter)
         
-        self.lbl_stat = QLabel("ОТКЛЮЧЕНО")
+        self.lbl_stat = QLabel("ПРОВЕРКА...")
         self.lbl_stat.setStyleSheet("color: #666; font-size: 14px; font-weight: 700; margin-top: 15px;")
         root.addWidget(self.lbl_stat, alignment=Qt.AlignmentFlag.AlignCenter)
         
@@ -310,6 +389,10 @@ class GeminiVPN(QWidget):
         self.opac.setOpacity(0.0)
         self.lbl_time.setGraphicsEffect(self.opac)
         root.addWidget(self.lbl_time, alignment=Qt.AlignmentFlag.AlignCenter)
+
+        self.lbl_perf = QLabel("")
+        self.lbl_perf.setStyleSheet("color: #444; font-size: 10px; font-weight: 600;")
+        root.addWidget(self.lbl_perf, alignment=Qt.AlignmentFlag.AlignCenter)
         
         root.addStretch()
         
@@ -317,6 +400,7 @@ class GeminiVPN(QWidget):
         self.btn_main.setFixedSize(240, 58)
         self.btn_main.setCursor(Qt.CursorShape.PointingHandCursor)
         self.btn_main.clicked.connect(self._handle_main_btn)
+        self.btn_main.setEnabled(False)
         root.addWidget(self.btn_main, alignment=Qt.AlignmentFlag.AlignCenter)
 
         root.addSpacing(5)
@@ -324,7 +408,8 @@ class GeminiVPN(QWidget):
         self.btn_update = QPushButton("ОБНОВИТЬ БАЗУ")
         self.btn_update.setFixedSize(240, 58)
         self.btn_update.setCursor(Qt.CursorShape.PointingHandCursor)
-        self.btn_update.clicked.connect(self._handle_update_btn)
+        # clicked(bool) would land in `source`.
+        self.btn_update.clicked.connect(lambda: self._handle_update_btn())
         self.btn_update.setVisible(False)
         root.addWidget(self.btn_update, alignment=Qt.AlignmentFlag.AlignCenter)
 
@@ -338,15 +423,14 @@ class GeminiVPN(QWidget):
         don_lyt = QHBoxLayout()
         don_lyt.setContentsMargins(0, 0, 0, 0)
         
-        h_svg = QSvgWidget()
-        h_svg.setFixedSize(18, 18)
-        h_svg.load(QByteArray(HEART_SVG.format(color="#888888").encode()))
-        h_svg.setStyleSheet("background: transparent; border: none;")
+        self.h_svg = QLabel()
+        self.h_svg.setFixedSize(18, 18)
+        self.h_svg.setStyleSheet("background: transparent; border: none;")
         
         don_btn_lyt = QHBoxLayout(self.btn_donate)
         don_btn_lyt.setContentsMargins(65, 0, 0, 0)
         don_btn_lyt.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter)
-        don_btn_lyt.addWidget(h_svg)
+        don_btn_lyt.addWidget(self.h_svg)
         
         don_lyt.addWidget(self.btn_donate, alignment=Qt.AlignmentFlag.AlignCenter)
         root.addLayout(don_lyt)
@@ -360,10 +444,25 @@ class GeminiVPN(QWidget):
         path.addRoundedRect(1, 1, self.width()-2, self.height()-2, 30, 30)
         p.fillPath(path, QColor("#0A0A0C"))
         p.strokePath(path, QPen(QColor("#1A1A1D"), 2))
+        if not self._ready and PROFILER.elapsed("first_paint") is None:
+            PROFILER.mark("first_paint")
+            QTimer.singleShot(0, self._finish_startup)
+
+    def showEvent(self, e):
+        super().showEvent(e)
+        self._sync_timer()
+
+    def hideEvent(self, e):
+        super().hideEvent(e)
+        self._sync_timer()
+
+    def changeEvent(self, e):
+        super().changeEvent(e)
+        if e.type() == QEvent.Type.WindowStateChange:
+            self._sync_timer()
 
     def _draw_logo(self):
-        d = LOGO_SVG.format(c1=self.c_cur[0].name(), c2=self.c_cur[1].name(), c3=self.c_cur[2].name())
-        self.logo.load(QByteArray(d.encode()))
+        self.logo.setPixmap(SVG_CACHE.pixmap(LOGO_SVG, 90, self.devicePixelRatioF(), c1=self.c_cur[0].name(), c2=self.c_cur[1].name(), c3=self.c_cur[2].name()))
 
     def _update_style(self):
         btn_tpl = "QPushButton {{ background: {bg}; color: {tc}; border-radius: 18px; font-weight: 800; font-size: 13px; border: 2px solid #1A1A1D; }} QPushButton:hover {{ background: {hbg}; }} QPushButton:pressed {{ background: {pbg}; }}"
@@ -383,6 +482,8 @@ class GeminiVPN(QWidget):
         self.tray = QSystemTrayIcon(self)
         self.tray.setIcon(self._app_icon)
         self.menu = QMenu()
+        # The tray entry is refreshed when the menu opens, not on a timer.
+        self.menu.aboutToShow.connect(self._update_tray_time)
         self.menu.setStyleSheet("QMenu { background: #0A0A0C; color: #A0A0A0; border: 1px solid #1A1A1D; } QMenu::item:selected { background: #1A1A1D; color: #FFF; }")
         
         self.show_act = QAction("Открыть", self)
@@ -394,13 +495,30 @@ class GeminiVPN(QWidget):
         self.timer_act = QAction("Время: 00:00:00", self)
         self.timer_act.setEnabled(False)
         self.timer_act.setVisible(False)
+
+        self.perf_act = QAction("", self)
+        self.perf_act.setEnabled(False)
+        self.perf_act.setVisible(False)
         
         self.exit_act = QAction("Выход", self)
+        # A download in flight is dropped on exit; a write already under way still completes.
+        self.exit_act.triggered.connect(lambda: self.ops.queue.cancel())
         self.exit_act.triggered.connect(QApplication.quit)
         
         self.menu.addAction(self.show_act)
         self.menu.addAction(self.toggle_act)
         self.menu.addAction(self.timer_act)
+        self.menu.addAction(self.perf_act)
+
+        self.profile_menu = self.menu.addMenu("Сервисы")
+        self.profile_acts = {}
+        for key in ["all"] + list(PROFILES):
+            act = QAction(AppConfig.PROFILE_TITLES.get(key, key), self)
+            act.setCheckable(True)
+            act.triggered.connect(lambda checked, k=key: self._toggle_profile(k, checked))
+            self.profile_menu.addAction(act)
+            self.profile_acts[key] = act
+        self._sync_profile_menu()
         self.menu.addSeparator()
         self.menu.addAction(self.exit_act)
         
@@ -408,7 +526,30 @@ class GeminiVPN(QWidget):
         self.tray.activated.connect(lambda r: self._show_me() if r in (QSystemTrayIcon.ActivationReason.Trigger, QSystemTrayIcon.ActivationReason.DoubleClick) else None)
         self.tray.show()
 
+    def _sync_profile_menu(self):
+        profiles = load_settings()["profiles"] or ["all"]
+        for key, act in self.profile_acts.items():
+            act.setChecked(key in profiles)
+
+    def _toggle_profile(self, key, checked):
+        settings = load_settings()
+        current = [p for p in settings["profiles"] if p != "all"]
+        if key == "all":
+            profiles = ["all"]
+        elif checked:
+            profiles = current + [key]
+        else:
+            profiles = [p for p in current if p != key]
+        settings["profiles"] = profiles or ["all"]
+        save_settings(settings)
+        self._sync_profile_menu()
+        # Connected: rewrite the block for the new selection right away; otherwise it applies on connect.
+        if self._is_connected:
+            self._handle_update_btn()
+
     def handle_second_instance(self):
+        if not self._ready:
+            return
         self.show_act.setText("Закрыть")
         self.show_act.triggered.disconnect()
         self.show_act.triggered.connect(QApplication.quit)
@@ -417,18 +558,28 @@ class GeminiVPN(QWidget):
         self.showNormal()
         self.activateWindow()
 
+    def _show_perf(self, summary):
+        text = format_perf(summary)
+        self.lbl_perf.setText(text)
+        self.perf_act.setText(f"Операции: {text}")
+        self.perf_act.setVisible(bool(text))
+
+    @property
+    def _is_processing(self):
+        return self.ops.queue.busy
+
     def _init_state(self):
-        if check_installation():
+        self._show_perf(summarize_metrics())
+        if self.status.installed:
             self._is_connected = True
             self._set_ui_connected()
         else:
             self._is_connected = False
             self._set_ui_disconnected()
 
-    def _check_status_loop(self):
+    def _on_status_changed(self, st):
         if self._is_processing:
             return
-        st = check_installation()
         if st and not self._is_connected:
             self._is_connected = True
             self._set_ui_connected()
@@ -437,74 +588,84 @@ class GeminiVPN(QWidget):
             self._set_ui_disconnected()
 
     def _handle_main_btn(self):
-        if self._is_processing:
+        # Toggles against what the queue is about to do, not the last finished state: a second
+        # click while connecting cancels the download instead of waiting for it.
+        intent = self.ops.queue.intent()
+        connected = intent in APPLY_ACTIONS if intent else self._is_connected
+        self.ops.queue.submit("uninstall" if connected else "install")
+        self._show_busy()
+
+    def _handle_update_btn(self, source="user"):
+        self.ops.queue.submit("update", source)
+        self._show_busy()
+
+    def _show_busy(self, *_):
+        intent = self.ops.queue.intent()
+        if intent is None:
             return
-        self._is_processing = True
-        self.btn_main.setEnabled(False)
-        self.btn_update.setEnabled(False)
-        self.toggle_act.setEnabled(False)
+        depth = self.ops.queue.depth()
+        text = {"install": "ПОДКЛЮЧЕНИЕ...", "update": "ОБНОВЛЕНИЕ БАЗЫ...", "uninstall": "ОТКЛЮЧЕНИЕ..."}[intent]
+        self.lbl_stat.setText(text if depth < 2 else f"{text} (ОЧЕРЕДЬ: {depth})")
+        self.lbl_stat.setStyleSheet("color: #F59E0B; font-size: 14px; font-weight: 700; margin-top: 15px;")
+        self.btn_main.setText({"install": "ОТМЕНИТЬ", "update": "ОТКЛЮЧИТЬСЯ", "uninstall": "ПОДКЛЮЧИТЬСЯ"}[intent])
+        self.btn_update.setText("ОБНОВЛЕНИЕ...")
+        self.btn_update.setEnabled(intent != "uninstall")
+        self.toggle_act.setText(self.btn_main.text().capitalize())
         self.timer_act.setVisible(False)
         self._anim_opac(False)
-        
-        if self._is_connected:
-            self.btn_main.setText("ОТКЛЮЧЕНИЕ...")
-            self.lbl_stat.setText("ОТКЛЮЧЕНИЕ...")
-            self.lbl_stat.setStyleSheet("color: #F59E0B; font-size: 14px; font-weight: 700; margin-top: 15px;")
-            self._anim_logo_to(AppConfig.GRADIENT_CONN)
-            self.worker = HostsWorker("uninstall")
-        else:
-            self.btn_main.setText("ПОДКЛЮЧЕНИЕ...")
-            self.lbl_stat.setText("ПОДКЛЮЧЕНИЕ...")
-            self.lbl_stat.setStyleSheet("color: #F59E0B; font-size: 14px; font-weight: 700; margin-top: 15px;")
-            self._anim_logo_to(AppConfig.GRADIENT_CONN)
-            self.worker = HostsWorker("install")
-            
+        self._anim_logo_to(AppConfig.GRADIENT_CONN)
         self._update_style()
-        self.worker.finished_signal.connect(self._on_worker_finished)
-        self.worker.start()
+        self._sync_timer()
 
-    def _handle_update_btn(self):
+    def _arm_update_timer(self, delay=None):
+        if not self.schedule.enabled:
+            return
+        if delay is None:
+            # Capped so suspend/resume and clock changes are noticed within the hour.
+            delay = min(self.schedule.seconds_until(), 3600)
+        self.update_timer.start(int(delay * 1000))
+
+    def _auto_update_tick(self):
+        if not self.schedule.due():
+            self._arm_update_timer()
+        elif not self._is_connected or self.ops.queue.intent() == "uninstall":
+            self._arm_update_timer(3600)
+        else:
+            # Coalesces with an update the user already queued.
+            self._handle_update_btn("auto")
+
+    def _on_op_finished(self, ticket):
+        # Folded-away and cancelled requests never ran to completion: nothing to record or report.
+        if ticket.summary:
+            self._show_perf(ticket.summary)
+        if ticket.action in APPLY_ACTIONS and ticket.status in ("done", "failed"):
+            if ticket.status == "done":
+                self.schedule.record_success(ticket.op.plan.changed)
+            else:
+                self.schedule.record_failure()
+            self._arm_update_timer()
+        if ticket.status == "failed":
+            if ticket.source in ("auto", "late"):
+                self.tray.showMessage(AppConfig.APP_NAME, "Не удалось обновить базу, повторим позже.", QSystemTrayIcon.MessageIcon.Warning, 3000)
+            else:
+                QMessageBox.warning(self, "Ошибка", "Не удалось выполнить операцию.\nПроверьте права доступа и сеть.")
+        failed = [r["path"] for r in ticket.op.results if r["error"]] if ticket.status == "done" else []
+        if failed:
+            self.tray.showMessage(AppConfig.APP_NAME, "Не удалось записать:\n" + "\n".join(failed), QSystemTrayIcon.MessageIcon.Warning, 5000)
         if self._is_processing:
+            self._show_busy()
             return
-        self._is_processing = True
-        self.btn_main.setEnabled(False)
-        self.btn_update.setEnabled(False)
-        self.toggle_act.setEnabled(False)
-        self.timer_act.setVisible(False)
-        self._anim_opac(False)
-        
-        self.btn_update.setText("ОБНОВЛЕНИЕ...")
-        self.lbl_stat.setText("ОБНОВЛЕНИЕ БАЗЫ...")
-        self.lbl_stat.setStyleSheet("color: #F59E0B; font-size: 14px; font-weight: 700; margin-top: 15px;")
-        self._anim_logo_to(AppConfig.GRADIENT_CONN)
-        
-        self.worker = HostsWorker("update")
-        self.worker.finished_signal.connect(self._on_worker_finished)
-        self.worker.start()
-
-    def _on_worker_finished(self, success, action):
-        self._is_processing = False
-        self.btn_main.setEnabled(True)
         self.btn_update.setEnabled(True)
-        self.toggle_act.setEnabled(True)
         self.btn_update.setText("ОБНОВИТЬ БАЗУ")
-        
-        if success:
-            if action in ("install", "update"):
-                self._is_connected = True
-                self._set_ui_connected()
-            else:
-                self._is_connected = False
-                self._set_ui_disconnected()
+        self._is_connected = self.status.refresh()
+        if self._is_connected:
+            self._set_ui_connected()
         else:
-            QMessageBox.warning(self, "Ошибка", "Не удалось выполнить операцию.\nПроверьте права доступа и сеть.")
-            if self._is_connected:
-                self._set_ui_connected()
-            else:
-                self._set_ui_disconnected()
+            self._set_ui_disconnected()
 
     def _set_ui_connected(self):
-        if not check_installation():
+        if not self.status.installed:
+            self._is_connected = False
             self._set_ui_disconnected()
             return
         self.btn_main.setText("ОТКЛЮЧИТЬСЯ")
@@ -517,7 +678,9 @@ class GeminiVPN(QWidget):
             self._anim_opac(True)
         self._anim_logo_to(AppConfig.GRADIENT_ON)
         self._update_style()
-        self._update_timer_label()
+        # Captured once per connect/update; every tick after that is arithmetic on it.
+        self._since = self.status.since
+        self._sync_timer()
 
     def _set_ui_disconnected(self):
         self.btn_main.setText("ПОДКЛЮЧИТЬСЯ")
@@ -529,37 +692,61 @@ class GeminiVPN(QWidget):
         self._anim_opac(False)
         self._anim_logo_to(AppConfig.GRADIENT_OFF)
         self._update_style()
+        self._since = None
+        self._sync_timer()
+
+    def _elapsed(self):
+        if self._since is None:
+            return None
+        return max(time.time() - self._since, 0.0)
+
+    def _format_elapsed(self, diff):
+        diff = int(diff)
+        return f"{diff//3600:02d}:{(diff%3600)//60:02d}:{diff%60:02d}"
+
+    def _timer_wanted(self):
+        # The time is on screen: connected, idle, window shown and not minimized.
+        return self._ready and self._is_connected and not self._is_processing and self._since is not None and self.isVisible() and not self.isMinimized()
+
+    def _sync_timer(self):
+        if self._timer_wanted():
+            if not self.timer.isActive():
+                self._update_timer_label()
+        elif self._ready:
+            self.timer.stop()
 
     def _update_timer_label(self):
-        if self._is_connected and not self._is_processing and os.path.exists(HOSTS_PATH):
-            try:
-                mtime = os.path.getmtime(HOSTS_PATH)
-                diff = int(time.time() - mtime)
-                if diff < 0:
-                    diff = 0
-                t_str = f"{diff//3600:02d}:{(diff%3600)//60:02d}:{diff%60:02d}"
-                self.lbl_time.setText(t_str)
-                self.timer_act.setText(f"Время: {t_str}")
-            except:
-                pass
-        self.update()
+        # Repaints the label only; the next tick lands on the next whole second of elapsed time.
+        diff = self._elapsed()
+        if diff is None:
+            return
+        self.lbl_time.setText(self._format_elapsed(diff))
+        if self._timer_wanted():
+            # Coarse timers may fire a little early; never schedule a tick for the same second again.
+            left = 1.0 - diff % 1.0
+            self.timer.start(int((left if left > 0.1 else left + 1.0) * 1000))
+
+    def _update_tray_time(self):
+        diff = self._elapsed()
+        if diff is not None:
+            self.timer_act.setText(f"Время: {self._format_elapsed(diff)}")
 
     def _anim_logo_to(self, target_gradient):
         self.a_col = QVariantAnimation(self)
         self.a_col.setDuration(400)
-        s = [QColor(c) for c in self.c_cur]
-        self.a_col.valueChanged.connect(lambda v: self._step_logo(v, s, target_gradient))
+        frames = logo_frames([QColor(c) for c in self.c_cur], target_gradient, 90, self.devicePixelRatioF())
+        self.a_col.valueChanged.connect(lambda v: self._step_logo(v, frames))
         self.a_col.setStartValue(0.0)
         self.a_col.setEndValue(1.0)
         self.a_col.start()
 
-    def _step_logo(self, v, s, e):
-        for i in range(3):
-            r = int(s[i].red() + (e[i].red() - s[i].red()) * v)
-            g = int(s[i].green() + (e[i].green() - s[i].green()) * v)
-            b = int(s[i].blue() + (e[i].blue() - s[i].blue()) * v)
-            self.c_cur[i] = QColor(r, g, b)
-        self._draw_logo()
+    def _step_logo(self, v, frames):
+        cols, pix = frames[round(v * (len(frames) - 1))]
+        if pix is self._logo_pix:
+            return
+        self.c_cur = list(cols)
+        self._logo_pix = pix
+        self.logo.setPixmap(pix)
 
     def _anim_opac(self, show):
         self.a_op = QVariantAnimation(self)
@@ -587,17 +774,30 @@ def main():
     
     app = QApplication(sys.argv)
     app.setQuitOnLastWindowClosed(False)
-    
-    instance = SingleInstance(AppConfig.INSTANCE_LOCK_KEY)
-    if instance.is_running:
-        return 0
+    PROFILER.mark("qapp")
     
     icon_file = get_resource_path("icon.ico")
     app_icon = QIcon(icon_file) if os.path.exists(icon_file) else app.style().standardIcon(app.style().StandardPixmap.SP_ComputerIcon)
     
     window = GeminiVPN(app_icon)
+    PROFILER.mark("window")
+
+    instance = SingleInstance(AppConfig.INSTANCE_LOCK_KEY)
     instance.show_requested.connect(window.handle_second_instance)
+
+    def on_resolved(running):
+        PROFILER.mark("instance")
+        if running:
+            # Another copy owns the lock and has been notified through it.
+            window.hide()
+            app.exit(0)
+        else:
+            window.set_primary()
+
+    instance.resolved.connect(on_resolved)
     window.show()
+    # Started from the event loop so app.exit() above is never called before app.exec().
+    QTimer.singleShot(0, instance.start)
     
     return app.exec()
 
@@ -0,0 +1,119 @@
+import ssl
+import time
+import asyncio
+import ipaddress
+
+# A challenger has to beat the applied IP by this much before the hosts file is rewritten for it.
+SWITCH_RATIO = 0.8
+SWITCH_MARGIN = 0.010
+
+def is_sinkhole(ip):
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return True
+    return addr.is_unspecified or ip in ("127.0.0.1", "::1")
+
+def family(ip):
+    return 6 if ":" in ip else 4
+
+async def probe_ip(ip, port=443, timeout=1.5, sni=None, attempts=2):
+    best = None
+    ctx = ssl.create_default_context() if sni else None
+    for _ in range(attempts):
+        started = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port, ssl=ctx, server_hostname=sni), timeout)
+        except (OSError, asyncio.TimeoutError, ssl.SSLError):
+            continue
+        took = time.perf_counter() - started
+        writer.close()
+        try:
+            await asyncio.wait_for(writer.wait_closed(), timeout)
+        except (OSError, asyncio.TimeoutError, ssl.SSLError):
+            pass
+        best = took if best is None else min(best, took)
+    return best
+
+async def probe_all(targets, port=443, timeout=1.5, concurrency=64, attempts=2):
+    # targets: iterable of (ip, sni); sni=None measures plain TCP connect.
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(target):
+        async with sem:
+            return target, await probe_ip(target[0], port, timeout, target[1], attempts)
+
+    return dict(await asyncio.gather(*(one(t) for t in set(targets))))
+
+def pick_fastest(entries, applied=(), alternatives=None, port=443, timeout=1.5, concurrency=64, tls=False, attempts=2):
+    # For every (name, address family) with more than one routable candidate IP, keep only the
+    # fastest healthy one. Returns (entries, stats); entries keep the order of first appearance.
+    # applied may be a lazy iterable; it is read at most once.
+    alternatives = alternatives or {}
+    sinkholes = {}
+
+    def extend(pool, ip, fam):
+        for cand in [ip] + list(alternatives.get(ip, ())):
+            if cand not in sinkholes:
+                sinkholes[cand] = is_sinkhole(cand)
+            if cand not in pool and not sinkholes[cand] and family(cand) == fam:
+                pool.append(cand)
+
+    # Most names have a single IP: remember only the first one per family and build candidate
+    # pools just for the names that turn out to have more.
+    first = {4: {}, 6: {}}
+    candidates = {}
+    for ip, name in entries:
+        if ip not in sinkholes:
+            sinkholes[ip] = is_sinkhole(ip)
+        if sinkholes[ip]:
+            continue
+        fam = family(ip)
+        key = (name, fam)
+        seen = first[fam].setdefault(name, ip)
+        if key not in candidates:
+            if seen == ip and ip not in alternatives:
+                continue
+            candidates[key] = []
+            extend(candidates[key], seen, fam)
+        extend(candidates[key], ip, fam)
+    contested = {key: pool for key, pool in candidates.items() if len(pool) > 1}
+    stats = {"contested": len(contested), "probed": 0, "switched": 0}
+    if not contested:
+        return list(entries), stats
+
+    targets = {(ip, name if tls else None) for (name, _), pool in contested.items() for ip in pool}
+    stats["probed"] = len(targets)
+    latency = asyncio.run(probe_all(targets, port, timeout, concurrency, attempts))
+
+    current = {}
+    for ip, name in applied:
+        key = (name, family(ip))
+        if key in contested:
+            current[key] = ip
+    winners = {}
+    for key, pool in contested.items():
+        name = key[0]
+        timed = [(latency.get((ip, name if tls else None)), ip) for ip in pool]
+        healthy = sorted((t, ip) for t, ip in timed if t is not None)
+        if not healthy:
+            continue
+        best_t, best_ip = healthy[0]
+        keep = current.get(key)
+        keep_t = latency.get((keep, name if tls else None)) if keep in pool else None
+        if keep_t is not None and best_ip != keep and best_t > keep_t * SWITCH_RATIO - SWITCH_MARGIN:
+            best_ip = keep
+        winners[key] = best_ip
+        if best_ip != pool[0]:
+            stats["switched"] += 1
+
+    out = []
+    emitted = set()
+    for ip, name in entries:
+        key = (name, family(ip))
+        if key not in winners:
+            out.append((ip, name))
+        elif key not in emitted:
+            emitted.add(key)
+            out.append((winners[key], name))
+    return out, stats
\ No newline at end of file